@@ -1,12 +1,16 @@
 import os
-import json
 import random
 import string
-import requests
-import boto3
 import streamlit as st
-from jinja2 import Template
-from tempfile import NamedTemporaryFile
+from concurrent.futures import ThreadPoolExecutor
+from rate_limiter import acquire
+from connections import get_s3_client
+from streaming import post_chat
+from storage import put_html
+from pexels import Rehost, search_image_url
+from templates import get_template
+from contracts import KEYWORD_QUESTIONS
+from question_bank import reusable_questions, save_questions
 
 # ===== 🔐 Secrets from st.secrets =====
 AZURE_API_KEY     = st.secrets["AZURE_API_KEY"]
@@ -22,6 +26,12 @@ AWS_BUCKET     = st.secrets["AWS_BUCKET"]
 S3_PREFIX      = "suvichaarstories"
 DISPLAY_BASE   = "https://suvichaar.org/stories"  # <-- for final output link
 
+# Optional: serve Pexels photos from our bucket instead of hot-linking them.
+PEXELS_REHOST = (
+    Rehost(get_s3_client(AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_REGION), AWS_BUCKET, S3_PREFIX, DISPLAY_BASE)
+    if st.secrets.get("PEXELS_REHOST") else None
+)
+
 def generate_slug_and_urls():
     nano = ''.join(random.choices(string.ascii_letters + string.digits, k=10)) + '_G'
     slug_full = f"generated-quiz_{nano}"
@@ -29,41 +39,76 @@ def generate_slug_and_urls():
     display_url = f"{DISPLAY_BASE}/{slug_full}.html"
     return slug_full, s3_key, display_url
 
-def search_pexels_image(query):
-    headers = {"Authorization": PEXELS_API_KEY}
-    params = {"query": query, "per_page": 1, "orientation": "portrait"}
-    try:
-        res = requests.get("https://api.pexels.com/v1/search", headers=headers, params=params, timeout=8)
-        photos = res.json().get("photos", [])
-        if photos:
-            return photos[0]["src"]["original"]
-    except Exception:
-        pass
-    return "https://via.placeholder.com/720x1280?text=No+Image"
+MAX_RETRIES = 1
 
-def analyze_keyword_with_gpt(keyword, context_prompt):
+def analyze_keywords_with_gpt(keywords, context_prompt):
+    """One MCQ per keyword from a single chat call, in keyword order; None where an item was missing or unrepairable."""
     endpoint = f"{AZURE_ENDPOINT}/openai/deployments/{AZURE_DEPLOYMENT}/chat/completions?api-version={AZURE_API_VERSION}"
     headers = {"api-key": AZURE_API_KEY, "Content-Type": "application/json"}
+    keyword_list = "\n".join(f"- {kw}" for kw in keywords)
     messages = [
         {"role": "system", "content": [{"type": "text", "text": context_prompt}]},
         {"role": "user", "content": [
             {"type": "text", "text":
-                f"Using the topic: '{keyword}', generate 1 MCQ question (suitable for a quiz) with 4 options, a correct_index, and return only valid JSON like: "
-                "{{'question': ..., 'options': [...], 'correct_index': ...}}. No extra text."}
+                f"For each of these keywords/topics, generate 1 MCQ question (suitable for a quiz) with 4 options and a correct_index:\n{keyword_list}\n"
+                "Return one item per keyword, with its keyword copied exactly. Return only valid JSON. No extra text."}
         ]}
     ]
-    payload = {"messages": messages, "temperature": 0.7, "max_tokens": 300}
-    res = requests.post(endpoint, headers=headers, json=payload)
+    payload = {
+        "messages": messages, "temperature": 0.7, "max_tokens": 250 * len(keywords) + 100,
+        "response_format": KEYWORD_QUESTIONS.response_format
+    }
+    acquire(AZURE_DEPLOYMENT, payload)
+    res = post_chat(endpoint, headers, payload)
+    results = [None] * len(keywords)
     if res.status_code != 200:
-        return None
+        return results
     try:
-        content = res.json()["choices"][0]["message"]["content"]
-        return json.loads(content)
+        items = KEYWORD_QUESTIONS.parse(res.json()["choices"][0]["message"]["content"])["questions"]
     except Exception:
-        return None
+        return results
+    # Results are per position, so a keyword entered twice gets two questions.
+    # An echoed keyword claims its first open slot; the rest fill by position.
+    wanted = [kw.strip().lower() for kw in keywords]
+    unmatched = []
+    for position, item in enumerate(items):
+        echoed = str(item.get("keyword", "")).strip().lower()
+        slot = next((i for i, kw in enumerate(wanted) if kw == echoed and results[i] is None), None)
+        if slot is None:
+            unmatched.append((position, item))
+        else:
+            results[slot] = item
+    for position, item in unmatched:
+        if position >= len(results) or results[position] is not None:
+            position = next((i for i, q in enumerate(results) if q is None), None)
+        if position is not None:
+            results[position] = item
+    return [q and {k: q[k] for k in ("question", "options", "correct_index")} for q in results]
+
+def generate_keyword_questions(keywords, context_prompt, reuse=False):
+    """Batched generation; only keywords whose item was missing or invalid are asked again.
+
+    With reuse, keywords that have a banked question skip GPT entirely.
+    """
+    questions = [None] * len(keywords)
+    if reuse:
+        for i, kw in enumerate(keywords):
+            banked = reusable_questions(kw, 1)
+            if banked:
+                questions[i] = banked[0]
+    for _ in range(1 + MAX_RETRIES):
+        missing = [i for i, q in enumerate(questions) if q is None]
+        if not missing:
+            break
+        generated = analyze_keywords_with_gpt([keywords[i] for i in missing], context_prompt)
+        for i, q in zip(missing, generated):
+            if q:
+                save_questions(keywords[i], [q])
+                questions[i] = q
+    return questions
 
 def render_quiz_html(data, image_urls, template_str):
-    template = Template(template_str)
+    template = get_template(template_str)
     html_data = {
         "pagetitle": data.get("title", "Untitled Quiz"),
         "storytitle": data.get("title", "Untitled Quiz"),
@@ -93,15 +138,8 @@ def render_quiz_html(data, image_urls, template_str):
     return template.render(**html_data)
 
 def upload_to_s3(content_str, s3_key):
-    s3 = boto3.client("s3",
-        aws_access_key_id=AWS_ACCESS_KEY,
-        aws_secret_access_key=AWS_SECRET_KEY,
-        region_name=AWS_REGION
-    )
-    with NamedTemporaryFile(delete=False, suffix=".html", mode="w", encoding="utf-8") as tmp:
-        tmp.write(content_str)
-        tmp.flush()
-        s3.upload_file(tmp.name, AWS_BUCKET, s3_key)
+    s3 = get_s3_client(AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_REGION)
+    put_html(s3, AWS_BUCKET, s3_key, content_str)
 
 # ===== Streamlit UI =====
 st.title("🧠 Keyword-based Quiz Generator (No Upload, Pexels Images)")
@@ -122,18 +160,20 @@ if uploaded_template and ready:
     results_text = st.text_input("Results Text:", value="You've completed the quiz!")
 
     context_prompt = "You are a quiz MCQ generator. For each keyword/topic, create one meaningful MCQ."
+    reuse = st.checkbox("♻️ Reuse banked questions first", value=True)
 
-    questions = []
-    image_urls = [search_pexels_image(quiz_topic)]  # Cover from quiz_topic/keyword
     st.info("Generating questions and fetching images...")
-    for idx, kw in enumerate(keywords):
-        st.write(f"🔍 Processing '{kw}' ...")
-        # Generate question for this keyword
-        q = analyze_keyword_with_gpt(kw, context_prompt)
+    # Pexels lookups for the cover and every keyword run while the one chat call is in flight.
+    with ThreadPoolExecutor(max_workers=len(keywords) + 1) as pool:
+        image_searches = [pool.submit(search_image_url, kw, PEXELS_API_KEY, rehost=PEXELS_REHOST) for kw in [quiz_topic] + keywords]
+        generated = generate_keyword_questions(keywords, context_prompt, reuse=reuse)
+        image_urls = [search.result() for search in image_searches]  # Cover from quiz_topic/keyword first
+
+    questions = []
+    for kw, q in zip(keywords, generated):
         if not q:
             q = {"question": f"Default Question for {kw}", "options": ["Option 1", "Option 2", "Option 3", "Option 4"], "correct_index": 0}
         questions.append(q)
-        image_urls.append(search_pexels_image(kw))
 
     quiz_data = {
         "title": quiz_title,
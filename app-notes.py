@@ -1,9 +1,16 @@
 # At top of your Streamlit app
-import os, json, random, string, time, requests, boto3
-from PIL import Image
-from io import BytesIO
+import os, random, string
+from functools import partial
 import streamlit as st
-from jinja2 import Template
+from image_engine import DALLE_URL, ImageBatch
+from rate_limiter import acquire
+from vision_input import image_content
+from connections import get_session, get_s3_client
+from storage import Publisher
+from streaming import post_chat, stream_json
+from contracts import NOTES_SLIDES
+from templates import get_template, jinja_variables, uses_any
+from image_derivatives import MIME_TYPES, SLIDE_SIZE, Rendition, derive, filename, responsive, srcset
 
 # === Secrets ===
 AZURE_API_KEY     = st.secrets["AZURE_API_KEY"]
@@ -22,56 +29,49 @@ DISPLAY_BASE      = "https://cdn.suvichaar.org"
 def generate_slug_and_urls():
     nano = ''.join(random.choices(string.ascii_letters + string.digits, k=10)) + '_G'
     slug = f"generated-summary_{nano}"
-    return slug, f"{S3_PREFIX}/{slug}.json", f"{S3_PREFIX}/{slug}.html", f"{DISPLAY_BASE}/{slug}.json", f"{DISPLAY_BASE}/{slug}.html"
+    # Keys are relative to S3_PREFIX, which the CDN serves at its root.
+    return slug, f"{slug}.json", f"{slug}.html", f"{DISPLAY_BASE}/{slug}.json", f"{DISPLAY_BASE}/{slug}.html"
 
-def summarize_notes_with_gpt_vision(image_urls):
+def summarize_notes_with_gpt_vision(note_images, on_slide=None):
+    # Notes go inline as downscaled data URLs, so Azure never fetches them from our CDN.
     messages = [
         {"role": "system", "content": "You're an educational summarizer. Create 5 slides (title, paragraph, image_prompt)."},
-        {"role": "user", "content": [{"type": "image_url", "image_url": {"url": url}} for url in image_urls] +
-         [{"type": "text", "text": "Summarize into 5 slides: title, paragraph, and image_prompt for each."}]}
+        {"role": "user", "content": [image_content(image_bytes) for image_bytes in note_images] +
+         [{"type": "text", "text": 'Summarize into 5 slides: title, paragraph, and image_prompt for each. Return JSON like {"slides": [...]}.'}]}
     ]
     headers = {"api-key": AZURE_API_KEY, "Content-Type": "application/json"}
     endpoint = f"{AZURE_ENDPOINT}/openai/deployments/{AZURE_DEPLOYMENT}/chat/completions?api-version={AZURE_API_VERSION}"
-    res = requests.post(endpoint, headers=headers, json={"messages": messages, "temperature": 0.7, "max_tokens": 1800})
+    payload = {"messages": messages, "temperature": 0.7, "max_tokens": 1800, "stream": True,
+               "response_format": NOTES_SLIDES.response_format}
+    acquire(AZURE_DEPLOYMENT, payload)
+    res = post_chat(endpoint, headers, payload)
     try:
-        return json.loads(res.json()["choices"][0]["message"]["content"])
+        return NOTES_SLIDES.parse(stream_json(res, on_item=on_slide))["slides"]
+    except Exception:
+        return [{"title": f"Slide {i+1}", "paragraph": "Placeholder", "image_prompt": "Default image"} for i in range(5)]
+
+def resize_and_upload_slide(publisher, slug, responsive_needed, index, image_url):
+    """(JPEG url, {format: srcset}) for one slide; srcsets only when the template uses them."""
+    url = image_url or "https://via.placeholder.com/1024x1024?text=No+Image"
+    slide = Rendition(f"slide{index+1}", SLIDE_SIZE)
+    sets = responsive(slide.name, SLIDE_SIZE) if responsive_needed else {}
+    try:
+        img_data = get_session("cdn").get(url).content
+        encoded = derive(img_data, [slide] + [r for group in sets.values() for r in group])
+
+        def publish(rendition):
+            key = f"{slug}/{filename(rendition)}"
+            return publisher.add(filename(rendition), key, encoded[rendition], MIME_TYPES[rendition.format])
+
+        srcsets = {fmt: srcset((publish(r), r.size[0]) for r in group) for fmt, group in sets.items()}
+        return publish(slide), srcsets
     except:
-        return [{"title": f"Slide {i+1}", "text": "Placeholder", "image_prompt": "Default image"} for i in range(5)]
-
-def generate_and_resize_images(prompts, slug):
-    dalle_url = "https://njnam-m3jxkka3-swedencentral.cognitiveservices.azure.com/openai/deployments/dall-e-3/images/generations?api-version=2024-02-01"
-    headers = {"Content-Type": "application/json", "api-key": DAALE_KEY}
-    s3 = boto3.client("s3", aws_access_key_id=AWS_ACCESS_KEY, aws_secret_access_key=AWS_SECRET_KEY, region_name=AWS_REGION)
-    urls = []
-
-    for i, prompt in enumerate(prompts):
-        payload = {"prompt": prompt, "n": 1, "size": "1024x1024"}
-        url = "https://via.placeholder.com/1024x1024?text=No+Image"
-        for _ in range(3):
-            res = requests.post(dalle_url, headers=headers, json=payload, timeout=30)
-            if res.status_code == 200:
-                url = res.json()["data"][0]["url"]
-                break
-            elif res.status_code == 429:
-                time.sleep(10)
-        try:
-            img_data = requests.get(url).content
-            img = Image.open(BytesIO(img_data)).convert("RGB")
-            img = img.resize((720, 1200))
-            buffer = BytesIO()
-            img.save(buffer, format="JPEG")
-            buffer.seek(0)
-            key = f"{S3_PREFIX}/{slug}/slide{i+1}.jpg"
-            s3.upload_fileobj(buffer, AWS_BUCKET, key)
-            urls.append(f"{DISPLAY_BASE}/{slug}/slide{i+1}.jpg")
-        except:
-            urls.append("https://via.placeholder.com/720x1200?text=Error")
-    return urls
-
-def upload_final_outputs(slide_data, html_content, json_key, html_key):
-    s3 = boto3.client("s3", aws_access_key_id=AWS_ACCESS_KEY, aws_secret_access_key=AWS_SECRET_KEY, region_name=AWS_REGION)
-    s3.put_object(Bucket=AWS_BUCKET, Key=json_key, Body=json.dumps(slide_data), ContentType="application/json")
-    s3.put_object(Bucket=AWS_BUCKET, Key=html_key, Body=html_content, ContentType="text/html")
+        return "https://via.placeholder.com/720x1200?text=Error", {}
+
+def upload_final_outputs(publisher, slide_data, html_content, json_key, html_key):
+    publisher.add_json("json", json_key, slide_data)
+    publisher.add_html("html", html_key, html_content)
+    return publisher.wait()
 
 # === Streamlit UI ===
 st.title("📘 Notes to Quiz Webstory Generator")
@@ -80,27 +80,65 @@ uploaded_images = st.file_uploader("📤 Upload Notes Images (5)", type=["png",
 html_template = st.file_uploader("📄 Upload HTML template", type="html")
 
 if uploaded_images and html_template:
-    st.info("📡 Uploading images to a temporary CDN...")
-    note_image_urls = []
-    s3 = boto3.client("s3", aws_access_key_id=AWS_ACCESS_KEY, aws_secret_access_key=AWS_SECRET_KEY, region_name=AWS_REGION)
+    s3 = get_s3_client(AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_REGION)
     slug, json_key, html_key, json_url, html_url = generate_slug_and_urls()
-    for idx, img in enumerate(uploaded_images):
-        key = f"{S3_PREFIX}/{slug}/note{idx+1}.jpg"
-        s3.upload_fileobj(img, AWS_BUCKET, key)
-        note_image_urls.append(f"{DISPLAY_BASE}/{slug}/note{idx+1}.jpg")
+    # Notes, slides, JSON and HTML all go through one publisher and upload in
+    # parallel; the notes are only archived, so their uploads run in the
+    # background while the vision call is in flight.
+    publisher = Publisher(s3, AWS_BUCKET, DISPLAY_BASE, key_prefix=S3_PREFIX)
+    note_images = [img.getvalue() for img in uploaded_images]
+    for idx, (img, image_bytes) in enumerate(zip(uploaded_images, note_images)):
+        publisher.add_media(f"note{idx+1}", image_bytes, img.type or "image/jpeg", prefix="media")
+
+    template_str = html_template.read().decode("utf-8")
+    # Templates that never show image_urls don't need any DALL·E images.
+    template_vars = jinja_variables(template_str)
+    images_needed = "image_urls" in template_vars
+    # WebP/AVIF srcsets are only encoded for templates that read them.
+    responsive_needed = images_needed and uses_any(template_vars, "image_srcsets", "image_avif_srcsets")
 
     st.info("🧠 Summarizing with GPT Vision...")
-    slides = summarize_notes_with_gpt_vision(note_image_urls)
-    prompts = [s["image_prompt"] for s in slides]
+    # Each slide's DALL·E image starts as soon as that slide has streamed in.
+    with ImageBatch(DAALE_KEY, url=DALLE_URL, postprocess=partial(resize_and_upload_slide, publisher, slug, responsive_needed)) as batch:
+        live = st.container()
+        streamed = []
+
+        def on_slide(slide):
+            streamed.append(slide)
+            live.markdown(f"**Slide {len(streamed)}: {slide.get('title', '')}**")
+            if images_needed:
+                batch.submit(len(streamed) - 1, slide.get("image_prompt", ""))
 
-    st.info("🎨 Generating and resizing DALL·E images...")
-    final_image_urls = generate_and_resize_images(prompts, slug)
+        slides = summarize_notes_with_gpt_vision(note_images, on_slide=on_slide)
+        final_image_urls = ["https://via.placeholder.com/720x1200?text=Error"] * len(slides)
+        final_srcsets = [{} for _ in slides]
+
+        if images_needed:
+            st.info("🎨 Generating and resizing DALL·E images...")
+            prompts = [s["image_prompt"] for s in slides]
+            # Slides that never streamed (e.g. the placeholder fallback) start now.
+            for index in range(len(batch), len(prompts)):
+                batch.submit(index, prompts[index])
+            for index, (slide_url, srcsets) in batch.results():
+                if index < len(final_image_urls):
+                    final_image_urls[index] = slide_url
+                    final_srcsets[index] = srcsets
 
     st.info("📄 Rendering HTML & uploading JSON...")
-    template_str = html_template.read().decode("utf-8")
-    jinja = Template(template_str)
-    rendered_html = jinja.render(slides=slides, image_urls=final_image_urls)
-    upload_final_outputs(slides, rendered_html, json_key, html_key)
+    jinja = get_template(template_str)
+    rendered_html = jinja.render(
+        slides=slides,
+        image_urls=final_image_urls,
+        image_srcsets=[sets.get("WEBP", "") for sets in final_srcsets],
+        image_avif_srcsets=[sets.get("AVIF", "") for sets in final_srcsets],
+    )
+    _, failed = upload_final_outputs(publisher, slides, rendered_html, json_key, html_key)
+    archive_failed = sorted(name for name in failed if name.startswith("note"))
+    if archive_failed:
+        st.warning(f"⚠️ Archiving failed for: {', '.join(archive_failed)}")
+    if len(failed) > len(archive_failed):
+        st.error(f"❌ Upload failed for: {', '.join(sorted(set(failed) - set(archive_failed)))}")
+        st.stop()
 
     st.success("✅ Files uploaded!")
     st.markdown(f"🔗 [View HTML]({html_url})")
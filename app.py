@@ -1,9 +1,20 @@
 import streamlit as st
 from PIL import Image
 from io import BytesIO
-import base64, requests, json, time, string, random, re
+import json, string, random
 from datetime import datetime, timezone
-import boto3
+from image_engine import DALLE_URL, Cooldown, generate_image
+from dag import DONE, FAILED, RUNNING, SKIPPED, Stage, run_stages
+from rate_limiter import acquire
+from vision_input import image_content
+from streaming import post_chat, stream_json
+from contracts import NOTES_STORY, SEO, ContractError
+from templates import fill_placeholders, placeholder_variables, uses_any
+from connections import get_session, get_s3_client
+from storage import Publisher
+from image_derivatives import (
+    MIME_TYPES, PORTRAIT_SIZE, SLIDE_SIZE, THUMB_SIZE, Rendition, derive, filename, responsive, srcset,
+)
 
 # ========== 🔐 Secrets ==========
 AZURE_API_KEY     = st.secrets["AZURE_API_KEY"]
@@ -28,13 +39,10 @@ def generate_slug_and_urls(title):
     return nano, slug_nano, f"https://suvichaar.org/stories/{slug_nano}", f"https://stories.suvichaar.org/{slug_nano}.html"
 
 def fill_placeholders_from_html(template_html: str, replacements: dict) -> str:
-    def replace_match(match):
-        key = match.group(1).strip()
-        return replacements.get(key, match.group(0))
-    return re.sub(r"\{\{(.*?)\}\}", replace_match, template_html)
+    return fill_placeholders(template_html, replacements)
 
 # ========== 🧠 GPT-4 Vision Prompt ==========
-def analyze_image(base64_img):
+def analyze_image(img_bytes, detail="high", on_field=None):
     prompt = """
 You are a helpful assistant. The user has uploaded a notes image.
 
@@ -64,70 +72,92 @@ Respond strictly in this JSON format:
     payload = {
         "messages": [
             {"role": "system", "content": prompt},
-            {"role": "user", "content": [{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}}]}
+            {"role": "user", "content": [image_content(img_bytes, detail=detail)]}
         ],
         "temperature": 0.7,
-        "max_tokens": 1000
+        "max_tokens": 1000,
+        "stream": True,
+        "response_format": NOTES_STORY.response_format
     }
-    res = requests.post(url, headers=headers, json=payload)
+    acquire(AZURE_DEPLOYMENT, payload)
+    res = post_chat(url, headers, payload)
     if res.status_code == 200:
         try:
-            return json.loads(res.json()["choices"][0]["message"]["content"])
-        except:
+            return NOTES_STORY.parse(stream_json(res, on_field=on_field))
+        except ContractError:
             st.error("⚠️ Invalid JSON returned.")
     else:
         st.error(f"❌ Error: {res.status_code} - {res.text}")
     return None
 
 # ========== 🎨 Image Generation ==========
-def generate_and_upload_images(result, slug):
-    dalle_url = "https://njnam-m3jxkka3-swedencentral.cognitiveservices.azure.com/openai/deployments/dall-e-3/images/generations?api-version=2024-02-01"
-    headers = {"Content-Type": "application/json", "api-key": DAALE_KEY}
-    s3 = boto3.client("s3", aws_access_key_id=AWS_ACCESS_KEY, aws_secret_access_key=AWS_SECRET_KEY, region_name=AWS_REGION)
-
-    for i in range(1, 7):
-        prompt = result.get(f"s{i}alt1", "")
-        payload = {"prompt": prompt, "n": 1, "size": "1024x1024"}
-
-        for _ in range(3):
-            res = requests.post(dalle_url, headers=headers, json=payload)
-            if res.status_code == 200:
-                image_url = res.json()["data"][0]["url"]
-                try:
-                    img_data = requests.get(image_url).content
-                    img = Image.open(BytesIO(img_data)).convert("RGB")
-                    img = img.resize((720, 1200))
-                    buffer = BytesIO()
-                    img.save(buffer, format="JPEG")
-                    buffer.seek(0)
-                    key = f"{S3_PREFIX}/{slug}/slide{i}.jpg"
-                    s3.upload_fileobj(buffer, AWS_BUCKET, key)
-                    result[f"s{i}image1"] = f"{DISPLAY_BASE}/{key}"
-                    break
-                except:
-                    result[f"s{i}image1"] = DEFAULT_ERROR_IMAGE
-            elif res.status_code == 429:
-                time.sleep(10)
-        else:
-            result[f"s{i}image1"] = DEFAULT_ERROR_IMAGE
-
-    try:
-        if result["s1image1"] != DEFAULT_ERROR_IMAGE:
-            img_data = requests.get(result["s1image1"]).content
-            img = Image.open(BytesIO(img_data)).convert("RGB")
-            img = img.resize((640, 853))
-            buffer = BytesIO()
-            img.save(buffer, format="JPEG")
-            buffer.seek(0)
-            key = f"{S3_PREFIX}/{slug}/portrait_cover.jpg"
-            s3.upload_fileobj(buffer, AWS_BUCKET, key)
-            result["potraitcoverurl"] = f"{DISPLAY_BASE}/{key}"
-        else:
-            result["potraitcoverurl"] = DEFAULT_ERROR_IMAGE
-    except:
-        result["potraitcoverurl"] = DEFAULT_ERROR_IMAGE
-
-    return result
+def image_stages(result, required=None):
+    """Stages that generate, resize and publish each slide image the template uses.
+
+    Each "slide{i}" stage needs "slug"; the final "images" stage waits for the
+    uploads and returns the placeholder -> URL mapping.
+    """
+    # required: placeholders the template uses; None means generate everything.
+    s3 = get_s3_client(AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_REGION)
+    publisher = Publisher(s3, AWS_BUCKET, DISPLAY_BASE)
+    cooldown = Cooldown()
+    cover_needed = required is None or uses_any(required, "potraitcoverurl", "potraightcoverurl")
+    slides = [i for i in range(1, 7) if required is None or f"s{i}image1" in required or (i == 1 and cover_needed)]
+
+    def resize_and_upload(slide, image_url, slug):
+        if not image_url:
+            return {f"s{slide}image1": DEFAULT_ERROR_IMAGE}
+        # Every rendition of this slide comes from one download and one decode.
+        renditions = {f"s{slide}image1": Rendition(f"slide{slide}", SLIDE_SIZE)}
+        if slide == 1 and cover_needed:
+            renditions["potraitcoverurl"] = Rendition("portrait_cover", PORTRAIT_SIZE)
+        if required is None or f"s{slide}thumb1" in required:
+            renditions[f"s{slide}thumb1"] = Rendition(f"thumb{slide}", THUMB_SIZE)
+        srcsets = {}
+        if required is None or uses_any(required, f"s{slide}image1_srcset", f"s{slide}image1_avif_srcset"):
+            sets = responsive(f"slide{slide}", SLIDE_SIZE)
+            srcsets[f"s{slide}image1_srcset"] = sets["WEBP"]
+            if "AVIF" in sets:
+                srcsets[f"s{slide}image1_avif_srcset"] = sets["AVIF"]
+        try:
+            img_data = get_session("cdn").get(image_url).content
+            all_renditions = list(renditions.values()) + [r for group in srcsets.values() for r in group]
+            encoded = derive(img_data, all_renditions)
+        except:
+            return {f"s{slide}image1": DEFAULT_ERROR_IMAGE}
+
+        # Uploads run on the publish pool while the other slides keep going.
+        def publish(name, rendition):
+            return publisher.add(name, f"{S3_PREFIX}/{slug}/{filename(rendition)}",
+                                 encoded[rendition], MIME_TYPES[rendition.format])
+
+        urls = {name: publish(name, rendition) for name, rendition in renditions.items()}
+        for name, group in srcsets.items():
+            urls[name] = srcset((publish(f"{name}:{filename(r)}", r), r.size[0]) for r in group)
+        return urls
+
+    def slide_stage(slide):
+        def run(slug):
+            try:
+                image_url = generate_image(result.get(f"s{slide}alt1", ""), DAALE_KEY, url=DALLE_URL, cooldown=cooldown)
+            except Exception:
+                image_url = None
+            return resize_and_upload(slide, image_url, slug[1])
+        return Stage(f"slide{slide}", run, ("slug",))
+
+    def collect(**slide_urls):
+        urls = {"potraitcoverurl": DEFAULT_ERROR_IMAGE} if cover_needed else {}
+        for stage_urls in slide_urls.values():
+            urls.update(stage_urls)
+        _, failed = publisher.wait()
+        for name in failed:
+            # A missing srcset width drops that srcset; src still has the JPEG.
+            key, _, part = name.partition(":")
+            urls[key] = "" if part else DEFAULT_ERROR_IMAGE
+        return urls
+
+    stages = [slide_stage(slide) for slide in slides]
+    return stages + [Stage("images", collect, tuple(stage.name for stage in stages))]
 
 # ========== 🧾 SEO Metadata ==========
 def generate_seo_metadata(result):
@@ -153,18 +183,22 @@ Respond strictly in this JSON format:
             {"role": "user", "content": seo_prompt}
         ],
         "temperature": 0.5,
-        "max_tokens": 300
+        "max_tokens": 300,
+        "response_format": SEO.response_format
     }
-    res = requests.post(url, headers=headers, json=payload)
+    acquire(AZURE_DEPLOYMENT, payload)
+    res = post_chat(url, headers, payload)
     if res.status_code == 200:
         try:
-            metadata = json.loads(res.json()["choices"][0]["message"]["content"])
-            return metadata.get("metadescription", ""), metadata.get("metakeywords", "")
-        except:
+            metadata = SEO.parse(res.json()["choices"][0]["message"]["content"])
+            return metadata["metadescription"], metadata["metakeywords"]
+        except Exception:
             return "", ""
     return "", ""
 
 # ========== 🖼️ Main App ==========
+STAGE_ICONS = {RUNNING: "⏳", DONE: "✅", FAILED: "❌", SKIPPED: "⏭️"}
+
 st.title("📚 Notes to AMP Web Story Generator")
 
 image_file = st.file_uploader("Upload Notes Image (JPG or PNG)", type=["jpg", "jpeg", "png"])
@@ -174,23 +208,52 @@ if image_file and html_template and st.button("🚀 Generate Story"):
     img_bytes = image_file.read()
     image = Image.open(BytesIO(img_bytes))
     st.image(image, caption="Uploaded Image", use_column_width=True)
-    base64_img = base64.b64encode(img_bytes).decode("utf-8")
 
-    result = analyze_image(base64_img)
-    if result:
-        nano, slug_nano, display_url, _ = generate_slug_and_urls(result["storytitle"])
-        result = generate_and_upload_images(result, slug_nano)
-        meta_desc, meta_keywords = generate_seo_metadata(result)
-        result["metadescription"] = meta_desc
-        result["metakeywords"] = meta_keywords
+    live = st.container()
 
+    def show_field(key, value):
+        if key == "storytitle":
+            live.markdown(f"### {value}")
+        elif key.endswith("paragraph1"):
+            live.markdown(f"- {value}")
+
+    result = analyze_image(img_bytes, on_field=show_field)
+    if result:
         html_template_str = html_template.read().decode("utf-8")
-        html_filled = fill_placeholders_from_html(html_template_str, result)
-        html_filled = html_filled.replace("{{canurl}}", display_url)
-        html_filled = html_filled.replace("{{potraightcoverurl}}", result.get("potraitcoverurl", DEFAULT_ERROR_IMAGE))
+        required = placeholder_variables(html_template_str)
+
+        # SEO only needs the text, so it runs alongside the slide images.
+        stages = [Stage("slug", lambda: generate_slug_and_urls(result["storytitle"]))]
+        stages += image_stages(result, required)
+        seo_needed = uses_any(required, "metadescription", "metakeywords")
+        if seo_needed:
+            stages.append(Stage("seo", lambda: generate_seo_metadata(result)))
+
+        progress = st.container()
+        rows = {stage.name: progress.empty() for stage in stages}
+
+        def show_stage(name, status, elapsed):
+            timing = f" ({elapsed:.1f}s)" if elapsed is not None else ""
+            rows[name].markdown(f"{STAGE_ICONS[status]} `{name}`{timing}")
+
+        outputs, errors = run_stages(stages, on_update=show_stage)
+        for name, error in errors.items():
+            st.warning(f"⚠️ Stage `{name}` failed: {error}")
+        nano, slug_nano, display_url, _ = outputs["slug"]
+        result.update(outputs.get("images", {}))
+        if seo_needed:
+            result["metadescription"], result["metakeywords"] = outputs.get("seo", ("", ""))
+
         now_iso = datetime.now(timezone.utc).isoformat(timespec='seconds')
-        html_filled = html_filled.replace("{{publishedtime}}", now_iso)
-        html_filled = html_filled.replace("{{modifiedtime}}", now_iso)
+        # One pass over the document; GPT fields win as they did before.
+        replacements = {
+            "canurl": display_url,
+            "potraightcoverurl": result.get("potraitcoverurl", DEFAULT_ERROR_IMAGE),
+            "publishedtime": now_iso,
+            "modifiedtime": now_iso,
+            **result,
+        }
+        html_filled = fill_placeholders_from_html(html_template_str, replacements)
 
         st.download_button("📥 Download HTML", html_filled, file_name=f"{slug_nano}.html", mime="text/html")
         st.download_button("📥 Download JSON", json.dumps(result, indent=2), file_name=f"{slug_nano}.json", mime="application/json")
@@ -0,0 +1,144 @@
+"""Headless batch quiz generation.
+
+    python batch_generate.py manifest.csv --template quiz.html --workers 4 > results.jsonl
+
+Each manifest row (CSV header or JSONL object) describes one quiz:
+
+    topic          keyword quiz topic (as in app-keyword-quiz.py)
+    image          path to an image to build the quiz from (as in app-image-focused-keywords.py);
+                   its images are found by the focus keyword the vision call returns
+    template       AMP template path; falls back to --template
+    images         "pexels" (default) or "dalle"
+    title, cover_heading, cover_subtext, results_text   optional overrides
+
+One JSON record per row is written as soon as that row finishes, with the
+story URL, any error and per-stage timings in seconds.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rate_limiter import BULK
+from contracts import IMAGE_QUIZ
+from quiz_core import (
+    FOCUS_KEYWORD_INSTRUCTIONS, generate_slug_and_urls, search_pexels_images, generate_dalle_images,
+    analyze_keyword_with_gpt, analyze_image_with_gpt, render_quiz_html, upload_to_s3,
+)
+
+KEYWORD_PROMPT = "You are a quiz MCQ generator. For the given keyword/topic, create 5 meaningful, unique MCQs."
+IMAGE_PROMPT = "You are a visual quiz assistant. Generate quiz from this image with 5 questions and results."
+
+
+def read_manifest(path):
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
+
+
+@lru_cache(maxsize=None)
+def _read_text(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+class _Timer:
+    def __init__(self):
+        self.timings = {}
+
+    def stage(self, name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.timings[name] = round(time.perf_counter() - start, 3)
+
+
+def process_row(row, default_template=None, upload=True, html_dir=None):
+    timer = _Timer()
+    topic = (row.get("topic") or "").strip()
+    image_path = (row.get("image") or "").strip()
+    template_path = row.get("template") or default_template
+    record = {"topic": topic, "image": image_path, "template": template_path}
+    try:
+        if not template_path:
+            raise ValueError("no template given")
+        if not (topic or image_path):
+            raise ValueError("row needs a topic or an image")
+        template_str = timer.stage("template", _read_text, template_path)
+
+        if image_path:
+            with open(image_path, "rb") as f:
+                image_bytes = f.read()
+            quiz = timer.stage(
+                "questions", analyze_image_with_gpt, image_bytes, IMAGE_PROMPT, priority=BULK,
+                contract=IMAGE_QUIZ, instructions=FOCUS_KEYWORD_INSTRUCTIONS,
+            )
+            if not quiz:
+                raise RuntimeError("vision analysis failed")
+            # The title is a headline, not a search term; images come from the focus keyword.
+            topic = topic or quiz.get("focus_keyword") or "quiz"
+        else:
+            questions = timer.stage("questions", analyze_keyword_with_gpt, topic, KEYWORD_PROMPT, n=5, priority=BULK)
+            if not questions:
+                raise RuntimeError("question generation failed")
+            quiz = {"title": f"Quiz on {topic.title()}", "questions": questions}
+
+        for field in ("title", "cover_heading", "cover_subtext", "results_text"):
+            if row.get(field):
+                quiz[field] = row[field]
+
+        if (row.get("images") or "pexels").lower() == "dalle":
+            image_urls = timer.stage("images", generate_dalle_images, topic, 5, priority=BULK)
+        else:
+            image_urls = timer.stage("images", search_pexels_images, topic, n=5)
+
+        html = timer.stage("render", render_quiz_html, quiz, image_urls, template_str)
+        slug, s3_key, display_url = generate_slug_and_urls()
+        if html_dir:
+            with open(os.path.join(html_dir, f"{slug}.html"), "w", encoding="utf-8") as f:
+                f.write(html)
+        if upload:
+            timer.stage("upload", upload_to_s3, html, s3_key)
+        record.update(slug=slug, s3_key=s3_key, url=display_url if upload else None,
+                      title=quiz.get("title"), status="ok")
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+    record["timings"] = timer.timings
+    return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate quiz stories from a CSV/JSONL manifest.")
+    parser.add_argument("manifest", help="CSV or JSONL file, one quiz per row")
+    parser.add_argument("--template", help="default AMP template for rows without one")
+    parser.add_argument("--workers", type=int, default=4, help="quizzes generated concurrently")
+    parser.add_argument("--out", help="JSONL output path (default: stdout)")
+    parser.add_argument("--no-upload", action="store_true", help="render only, skip S3")
+    parser.add_argument("--html-dir", help="also write each rendered story to this directory")
+    args = parser.parse_args(argv)
+
+    rows = read_manifest(args.manifest)
+    out = open(args.out, "a", encoding="utf-8") if args.out else sys.stdout
+    failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            futures = [pool.submit(process_row, row, args.template, not args.no_upload, args.html_dir) for row in rows]
+            for future in as_completed(futures):
+                record = future.result()
+                failed += record["status"] != "ok"
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"{len(rows) - failed}/{len(rows)} quizzes generated", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
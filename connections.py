@@ -0,0 +1,52 @@
+import threading
+import boto3
+import requests
+from botocore.config import Config
+from requests.adapters import HTTPAdapter
+
+# ===== 🔌 Shared keep-alive connections =====
+# Module state survives Streamlit reruns, so TLS sessions and the S3 client's
+# resolved credentials are reused across every run and session in the process.
+
+POOL_SIZES = {
+    "azure": 16,    # chat completions (all sessions share one deployment)
+    "dalle": 8,     # image generations, up to image_engine.MAX_WORKERS at once
+    "pexels": 8,
+    "cdn": 16,      # downloading generated/stock images
+}
+S3_MAX_POOL_CONNECTIONS = 32
+
+_sessions = {}
+_s3_clients = {}
+_lock = threading.Lock()
+
+
+def get_session(name):
+    """Keep-alive requests.Session for one upstream host group."""
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            size = POOL_SIZES.get(name, 10)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[name] = session
+        return session
+
+
+def get_s3_client(access_key, secret_key, region):
+    """One thread-safe S3 client per credential set, with a sized connection pool."""
+    key = (access_key, secret_key, region)
+    with _lock:
+        client = _s3_clients.get(key)
+        if client is None:
+            client = boto3.client(
+                "s3",
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                region_name=region,
+                config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS, retries={"mode": "adaptive"}),
+            )
+            _s3_clients[key] = client
+        return client
@@ -0,0 +1,270 @@
+import re
+import ast
+import json
+
+# ===== 📜 Response contracts =====
+# Each model payload has a contract: the JSON schema we send as
+# response_format, a precompiled local validator for the same schema, and a
+# deterministic repair pass (fences, pseudo-JSON quotes, trailing commas,
+# out-of-range answer indices) that runs before anything counts as a failure.
+
+
+class ContractError(ValueError):
+    pass
+
+
+def _compile(schema, required=None):
+    """Turn the subset of JSON schema we use into a function returning error strings."""
+    kind = schema.get("type")
+    if kind == "object":
+        properties = {key: _compile(sub) for key, sub in schema.get("properties", {}).items()}
+        required = schema.get("required", ()) if required is None else required
+
+        def check(value, path):
+            if not isinstance(value, dict):
+                return [f"{path}: expected object"]
+            errors = [f"{path}.{key}: missing" for key in required if key not in value]
+            for key, sub in properties.items():
+                if key in value:
+                    errors += sub(value[key], f"{path}.{key}")
+            return errors
+    elif kind == "array":
+        item = _compile(schema.get("items", {}))
+
+        def check(value, path):
+            if not isinstance(value, list):
+                return [f"{path}: expected array"]
+            errors = []
+            for i, element in enumerate(value):
+                errors += item(element, f"{path}[{i}]")
+            return errors
+    elif kind in ("string", "integer", "boolean"):
+        python_type = {"string": str, "integer": int, "boolean": bool}[kind]
+
+        def check(value, path):
+            # bool is an int subclass, but True is not an answer index.
+            if not isinstance(value, python_type) or (kind == "integer" and isinstance(value, bool)):
+                return [f"{path}: expected {kind}"]
+            return []
+    else:
+        def check(value, path):
+            return []
+    return check
+
+
+class Contract:
+    """Schema, local validator and repair step for one kind of model response.
+
+    required overrides the top-level keys the local check insists on; strict
+    response_format schemas must list every key, but the renderers have
+    defaults for most of them.
+    """
+
+    def __init__(self, name, schema, normalize=None, required=None):
+        self.name = name
+        self.schema = schema
+        self.normalize = normalize
+        self._check = _compile(schema, required)
+
+    @property
+    def response_format(self):
+        return {"type": "json_schema", "json_schema": {"name": self.name, "strict": True, "schema": self.schema}}
+
+    def validate(self, data):
+        return self._check(data, "$")
+
+    def parse(self, text):
+        """Repaired, normalized and validated payload; raises ContractError."""
+        data = repair_json(text)
+        if self.normalize:
+            data = self.normalize(data)
+        errors = self.validate(data)
+        if errors:
+            raise ContractError(f"{self.name}: " + "; ".join(errors[:5]))
+        return data
+
+
+# ----- repair -----
+
+_FENCE_RE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_JSON_WORDS = {"true": "True", "false": "False", "null": "None"}
+
+
+def _outer_value(text):
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        return text
+    start = min(starts)
+    end = max(text.rfind("}"), text.rfind("]"))
+    return text[start:end + 1] if end > start else text[start:]
+
+
+def repair_json(text):
+    """Parse model output that is JSON or close to it; raises ContractError."""
+    if not isinstance(text, str):
+        raise ContractError("no content")
+    candidate = _outer_value(_FENCE_RE.sub("", text.strip()))
+    for attempt in (candidate, _TRAILING_COMMA_RE.sub(r"\1", candidate)):
+        try:
+            return json.loads(attempt)
+        except ValueError:
+            pass
+    # Single-quoted pseudo-JSON is a valid Python literal.
+    python_literal = re.sub(r"\b(true|false|null)\b", lambda m: _JSON_WORDS[m.group(1)], _TRAILING_COMMA_RE.sub(r"\1", candidate))
+    for attempt in (candidate, python_literal):
+        try:
+            value = ast.literal_eval(attempt)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            continue
+        if isinstance(value, (dict, list)):
+            return value
+    raise ContractError("response is not JSON")
+
+
+def normalize_question(q):
+    """A cleaned {question, options, correct_index}, or None if it cannot be repaired."""
+    if not isinstance(q, dict):
+        return None
+    question = q.get("question")
+    options = q.get("options")
+    if not isinstance(question, str) or not question.strip() or not isinstance(options, list):
+        return None
+    options = [str(o).strip() for o in options if isinstance(o, (str, int, float)) and str(o).strip()][:4]
+    if len(options) != 4:
+        return None
+    index = q.get("correct_index")
+    if isinstance(index, str):
+        index = index.strip()
+        if len(index) == 1 and index.upper() in "ABCD":
+            index = "ABCD".index(index.upper())
+        elif index.lstrip("-").isdigit():
+            index = int(index)
+    if not isinstance(index, int) or isinstance(index, bool):
+        return None
+    return {"question": question.strip(), "options": options, "correct_index": min(max(index, 0), 3)}
+
+
+def _normalize_questions(data, keep_keyword=False):
+    # Unrepairable questions are dropped here rather than failing the payload.
+    if isinstance(data, list):
+        data = {"questions": data}
+    if isinstance(data, dict) and isinstance(data.get("questions"), list):
+        questions = []
+        for item in data["questions"]:
+            question = normalize_question(item)
+            if question is not None:
+                if keep_keyword:
+                    question["keyword"] = str(item.get("keyword", ""))
+                questions.append(question)
+        data = dict(data, questions=questions)
+    return data
+
+
+def require_questions(data):
+    """normalize for quiz payloads: repair questions and reject a quiz with none left."""
+    data = _normalize_questions(data)
+    if isinstance(data, dict) and not data.get("questions"):
+        raise ContractError("no valid questions")
+    return data
+
+
+def _normalize_seo(data):
+    if isinstance(data, dict) and isinstance(data.get("metakeywords"), list):
+        data = dict(data, metakeywords=", ".join(map(str, data["metakeywords"])))
+    return data
+
+
+# ----- schemas -----
+
+QUESTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string"},
+        "options": {"type": "array", "items": {"type": "string"}},
+        "correct_index": {"type": "integer"}
+    },
+    "required": ["question", "options", "correct_index"],
+    "additionalProperties": False
+}
+
+QUESTIONS = Contract("quiz_questions", {
+    "type": "object",
+    "properties": {"questions": {"type": "array", "items": QUESTION_SCHEMA}},
+    "required": ["questions"],
+    "additionalProperties": False
+}, normalize=_normalize_questions)
+
+KEYWORD_QUESTIONS = Contract("keyword_questions", {
+    "type": "object",
+    "properties": {
+        "questions": {
+            "type": "array",
+            "items": dict(QUESTION_SCHEMA,
+                          properties=dict(keyword={"type": "string"}, **QUESTION_SCHEMA["properties"]),
+                          required=["keyword"] + QUESTION_SCHEMA["required"])
+        }
+    },
+    "required": ["questions"],
+    "additionalProperties": False
+}, normalize=lambda data: _normalize_questions(data, keep_keyword=True))
+
+QUIZ = Contract("quiz", {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "cover_heading": {"type": "string"},
+        "cover_subtext": {"type": "string"},
+        "results_text": {"type": "string"},
+        "questions": {"type": "array", "items": QUESTION_SCHEMA}
+    },
+    "required": ["title", "cover_heading", "cover_subtext", "results_text", "questions"],
+    "additionalProperties": False
+}, normalize=require_questions, required=["questions"])
+
+# focus_keyword comes first so it finishes streaming long before the questions.
+IMAGE_QUIZ = Contract("image_quiz", {
+    "type": "object",
+    "properties": dict(focus_keyword={"type": "string"}, **QUIZ.schema["properties"]),
+    "required": ["focus_keyword"] + QUIZ.schema["required"],
+    "additionalProperties": False
+}, normalize=require_questions, required=["focus_keyword", "questions"])
+
+NOTES_STORY_FIELDS = ["storytitle"] + [f"s{i}paragraph1" for i in range(2, 7)] + [f"s{i}alt1" for i in range(1, 7)]
+NOTES_STORY = Contract("notes_story", {
+    "type": "object",
+    "properties": {field: {"type": "string"} for field in NOTES_STORY_FIELDS},
+    "required": NOTES_STORY_FIELDS,
+    "additionalProperties": False
+}, required=["storytitle"])
+
+NOTES_SLIDES = Contract("notes_slides", {
+    "type": "object",
+    "properties": {
+        "slides": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "title": {"type": "string"},
+                    "paragraph": {"type": "string"},
+                    "image_prompt": {"type": "string"}
+                },
+                "required": ["title", "paragraph", "image_prompt"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["slides"],
+    "additionalProperties": False
+}, normalize=lambda data: {"slides": data} if isinstance(data, list) else data)
+
+SEO = Contract("seo_metadata", {
+    "type": "object",
+    "properties": {
+        "metadescription": {"type": "string"},
+        "metakeywords": {"type": "string"}
+    },
+    "required": ["metadescription", "metakeywords"],
+    "additionalProperties": False
+}, normalize=_normalize_seo)
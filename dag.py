@@ -0,0 +1,62 @@
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# ===== 🕸️ Stage graph executor =====
+# Each stage names the stages whose results it needs; every stage whose inputs
+# are ready runs at once on a worker pool. Progress callbacks fire on the
+# calling thread, so they can update Streamlit elements directly.
+
+# fn is called with one keyword argument per entry in needs, holding that stage's result.
+Stage = namedtuple("Stage", "name fn needs")
+Stage.__new__.__defaults__ = ((),)
+
+RUNNING, DONE, FAILED, SKIPPED = "running", "done", "failed", "skipped"
+MAX_WORKERS = 8
+
+
+def run_stages(stages, on_update=None, max_workers=MAX_WORKERS):
+    """Run a stage graph; returns ({name: result}, {name: exception}).
+
+    A failed stage's dependents are skipped and report the upstream exception.
+    on_update(name, status, elapsed_seconds) is called as stages change state.
+    """
+    pending = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dep in stage.needs:
+            if dep not in pending:
+                raise ValueError(f"stage {stage.name!r} needs unknown stage {dep!r}")
+    results, errors, running = {}, {}, {}
+
+    def notify(name, status, elapsed=None):
+        if on_update:
+            on_update(name, status, elapsed)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                failed = next((dep for dep in stage.needs if dep in errors), None)
+                if failed is not None:
+                    del pending[name]
+                    errors[name] = errors[failed]
+                    notify(name, SKIPPED)
+                elif all(dep in results for dep in stage.needs):
+                    del pending[name]
+                    inputs = {dep: results[dep] for dep in stage.needs}
+                    running[pool.submit(stage.fn, **inputs)] = (name, time.perf_counter())
+                    notify(name, RUNNING)
+            if not running:
+                if pending:
+                    raise ValueError(f"stage graph has a cycle through {sorted(pending)}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, started = running.pop(future)
+                elapsed = time.perf_counter() - started
+                try:
+                    results[name] = future.result()
+                    notify(name, DONE, elapsed)
+                except Exception as e:
+                    errors[name] = e
+                    notify(name, FAILED, elapsed)
+    return results, errors
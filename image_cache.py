@@ -0,0 +1,178 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import tempfile
+from io import BytesIO
+from PIL import Image, ImageOps
+
+# ===== 🧬 Perceptual-hash result cache =====
+# The same textbook page gets uploaded again and again, re-cropped or
+# re-compressed along the way, so byte hashes never match. Each upload gets a
+# 64-bit dHash (gradient) and pHash (low DCT frequencies); a stored quiz is
+# reused when both are within a small Hamming distance of the new image.
+#
+# Text-heavy pages look alike at hash resolution, so the thresholds are kept
+# tight and requiring both hashes to agree guards against neighbouring pages.
+
+CACHE_DB = os.environ.get("IMAGE_CACHE_DB", os.path.join(tempfile.gettempdir(), "image_quiz_cache.sqlite"))
+CACHE_TTL = float(os.environ.get("IMAGE_CACHE_TTL", 7 * 24 * 60 * 60))
+MAX_ENTRIES = int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", 1000))
+# Measured on 60 synthetic A4 pages (text blocks, same layout): JPEG q35, PNG,
+# half/third-size resizes with recompression, +10% brightness and a 1 degree
+# rotation reach up to 8 bits on dHash and 4 (10 for the rotation) on pHash;
+# a 2% re-crop reaches 9 and 12, and a 5% re-crop is a different image. Of
+# 870 pairs of different pages the closest were 8 (dHash) and 6 (pHash), but
+# none were within 10 on both, so these match every re-encoded copy and most
+# 2% crops without a false match.
+DHASH_THRESHOLD = 8
+PHASH_THRESHOLD = 10
+HASH_SIDE = 8
+PHASH_SAMPLE = 32
+
+
+def _connect():
+    conn = sqlite3.connect(CACHE_DB, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, namespace TEXT, dhash TEXT,"
+        " phash TEXT, created REAL, last_hit REAL, result TEXT)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS results_namespace ON results (namespace, created)")
+    return conn
+
+
+def _grayscale(image_bytes, side):
+    img = Image.open(BytesIO(image_bytes))
+    img.draft("L", (side * 4, side * 4))
+    return ImageOps.exif_transpose(img).convert("L")
+
+
+def _bits(values, threshold):
+    h = 0
+    for v in values:
+        h = (h << 1) | (v > threshold)
+    return h
+
+
+def dhash(img):
+    # Each bit: is this pixel brighter than its right-hand neighbour?
+    w = HASH_SIDE + 1
+    px = list(img.resize((w, HASH_SIDE), Image.LANCZOS).getdata())
+    h = 0
+    for y in range(HASH_SIDE):
+        for x in range(HASH_SIDE):
+            h = (h << 1) | (px[y * w + x] > px[y * w + x + 1])
+    return h
+
+
+_COSINES = [[math.cos(math.pi * (2 * x + 1) * u / (2 * PHASH_SAMPLE)) for x in range(PHASH_SAMPLE)]
+            for u in range(HASH_SIDE)]
+
+
+def phash(img):
+    # Only the 8x8 lowest DCT frequencies are needed, so the separable DCT
+    # computes just those instead of the full 32x32 transform.
+    n = PHASH_SAMPLE
+    px = list(img.resize((n, n), Image.LANCZOS).getdata())
+    rows = [[sum(c * v for c, v in zip(cos, px[y * n:(y + 1) * n])) for cos in _COSINES] for y in range(n)]
+    coeffs = [sum(_COSINES[v][y] * rows[y][u] for y in range(n)) for v in range(HASH_SIDE) for u in range(HASH_SIDE)]
+    # The DC term is overall brightness; compare the rest against their median.
+    median = sorted(coeffs[1:])[len(coeffs[1:]) // 2]
+    return _bits(coeffs, median)
+
+
+def image_hashes(image_bytes):
+    """(dhash, phash) of an image as 64-bit ints."""
+    img = _grayscale(image_bytes, PHASH_SAMPLE)
+    return dhash(img), phash(img)
+
+
+def distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _namespace(namespace):
+    return namespace if isinstance(namespace, str) else json.dumps(namespace)
+
+
+def _matches(conn, hashes, namespace, now):
+    """[(distance, id, result)] for unexpired near-duplicates, closest first."""
+    d, p = hashes
+    matches = []
+    for row_id, row_d, row_p, result in conn.execute(
+        "SELECT id, dhash, phash, result FROM results WHERE namespace = ? AND created > ?",
+        (_namespace(namespace), now - CACHE_TTL),
+    ):
+        dd, dp = distance(d, int(row_d, 16)), distance(p, int(row_p, 16))
+        if dd <= DHASH_THRESHOLD and dp <= PHASH_THRESHOLD:
+            matches.append((dd + dp, row_id, result))
+    return sorted(matches)
+
+
+def lookup(hashes, namespace):
+    """The stored result for the closest near-duplicate image, or None."""
+    now = time.time()
+    conn = _connect()
+    try:
+        matches = _matches(conn, hashes, namespace, now)
+        if not matches:
+            return None
+        _, row_id, result = matches[0]
+        with conn:
+            conn.execute("UPDATE results SET last_hit = ? WHERE id = ?", (now, row_id))
+        return json.loads(result)
+    finally:
+        conn.close()
+
+
+def store(hashes, namespace, result, replace=False):
+    """Remember a result; expired entries go first, then the least recently used beyond MAX_ENTRIES.
+
+    replace drops the near-duplicates' older results so they stop matching.
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        with conn:
+            if replace:
+                conn.executemany("DELETE FROM results WHERE id = ?",
+                                 [(row_id,) for _, row_id, _ in _matches(conn, hashes, namespace, now)])
+            conn.execute(
+                "INSERT INTO results (namespace, dhash, phash, created, last_hit, result) VALUES (?, ?, ?, ?, ?, ?)",
+                (_namespace(namespace), f"{hashes[0]:016x}", f"{hashes[1]:016x}", now, now, json.dumps(result)),
+            )
+            conn.execute("DELETE FROM results WHERE created <= ?", (now - CACHE_TTL,))
+            conn.execute(
+                "DELETE FROM results WHERE id NOT IN (SELECT id FROM results ORDER BY last_hit DESC LIMIT ?)",
+                (MAX_ENTRIES,),
+            )
+    finally:
+        conn.close()
+
+
+def cached_result(image_bytes, namespace, compute, refresh=False):
+    """(result, from_cache): a near-duplicate's stored result, else compute() (stored when truthy).
+
+    namespace separates results that depend on more than the image, such as
+    the app and its prompt. refresh skips the lookup and the fresh result
+    replaces the stored one for later near-duplicate uploads.
+    """
+    try:
+        hashes = image_hashes(image_bytes)
+    except Exception:
+        return compute(), False
+    if not refresh:
+        try:
+            result = lookup(hashes, namespace)
+        except sqlite3.Error:
+            result = None
+        if result is not None:
+            return result, True
+    result = compute()
+    if result:
+        try:
+            store(hashes, namespace, result, replace=refresh)
+        except sqlite3.Error:
+            pass
+    return result, False
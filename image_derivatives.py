@@ -0,0 +1,98 @@
+from io import BytesIO
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+
+# ===== 🖼️ Image derivatives =====
+# Each source image is decoded once and every rendition (slide, portrait
+# cover, thumbnail) is resized from that single decode. Encodes run side by
+# side on a small pool, since Pillow releases the GIL while encoding.
+#
+# Slides also get responsive renditions: WebP (and AVIF where this Pillow can
+# write it) at several widths for srcset, with a progressive JPEG as the
+# plain src fallback.
+
+SLIDE_SIZE = (720, 1200)
+PORTRAIT_SIZE = (640, 853)
+THUMB_SIZE = (180, 300)
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+AVIF_QUALITY = 60
+SRCSET_WIDTHS = (360, 540, 720)
+ENCODE_WORKERS = 4
+
+# fit=True crops to the target aspect ratio instead of stretching.
+Rendition = namedtuple("Rendition", "name size format quality fit")
+Rendition.__new__.__defaults__ = ("JPEG", JPEG_QUALITY, False)
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "AVIF": "image/avif"}
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "AVIF": "avif"}
+
+try:  # older Pillow builds get AVIF from the optional plugin
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+Image.init()
+AVIF_AVAILABLE = "AVIF" in Image.SAVE
+
+_encode_pool = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="encode")
+
+
+def decode(data, largest=None):
+    """Decode to RGB once; JPEG sources are decoded at reduced scale when `largest` allows."""
+    img = Image.open(BytesIO(data))
+    if largest:
+        img.draft("RGB", largest)
+    img = ImageOps.exif_transpose(img)
+    return img.convert("RGB")
+
+
+def resize(img, size, fit=False):
+    # reduce() is a cheap integer box downscale; LANCZOS finishes the last step.
+    factor = min(img.width // size[0], img.height // size[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    if fit:
+        return ImageOps.fit(img, size, Image.LANCZOS)
+    return img.resize(size, Image.LANCZOS)
+
+
+def encode(img, fmt="JPEG", quality=JPEG_QUALITY):
+    buffer = BytesIO()
+    if fmt == "JPEG":
+        img.save(buffer, format=fmt, quality=quality, progressive=True, optimize=True)
+    else:
+        img.save(buffer, format=fmt, quality=quality)
+    return buffer.getvalue()
+
+
+def filename(rendition):
+    return f"{rendition.name}.{EXTENSIONS[rendition.format]}"
+
+
+def responsive(name, size, widths=SRCSET_WIDTHS):
+    """{format: [Rendition]} for srcset: WebP, plus AVIF when available, at each width up to size."""
+    formats = {"WEBP": WEBP_QUALITY}
+    if AVIF_AVAILABLE:
+        formats["AVIF"] = AVIF_QUALITY
+    return {
+        fmt: [Rendition(f"{name}-{w}", (w, round(w * size[1] / size[0])), fmt, quality)
+              for w in widths if w <= size[0]]
+        for fmt, quality in formats.items()
+    }
+
+
+def srcset(urls_and_widths):
+    return ", ".join(f"{url} {width}w" for url, width in urls_and_widths)
+
+
+def derive(data, renditions):
+    """Decode `data` once and return {rendition: encoded bytes} for each Rendition."""
+    largest = (max(r.size[0] for r in renditions), max(r.size[1] for r in renditions))
+    img = decode(data, largest)
+
+    def build(rendition):
+        return encode(resize(img, rendition.size, rendition.fit), rendition.format, rendition.quality)
+
+    futures = {r: _encode_pool.submit(build, r) for r in renditions}
+    return {r: future.result() for r, future in futures.items()}
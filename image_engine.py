@@ -0,0 +1,169 @@
+import re
+import time
+import random
+import threading
+import requests
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rate_limiter import INTERACTIVE, get_bucket
+from connections import get_session
+
+# ===== 🎨 Concurrent DALL·E image generation =====
+DALLE_URL = "https://njnam-m3jxkka3-swedencentral.cognitiveservices.azure.com/openai/deployments/dall-e-3/images/generations?api-version=2024-02-01"
+DALLE_DEPLOYMENT = "dall-e-3"
+MAX_WORKERS = 6
+MAX_ATTEMPTS = 4
+BASE_BACKOFF = 2.0
+MAX_BACKOFF = 60.0
+
+
+def _parse_duration(value):
+    # Accepts "12", "1.5", "20ms", "6m0s", "1h2m3s" style rate-limit values.
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(num) * scale[unit] for num, unit in parts)
+
+
+def retry_delay(headers):
+    """Seconds the server asked us to wait, or None if it gave no hint."""
+    if "retry-after-ms" in headers:
+        delay = _parse_duration(headers["retry-after-ms"])
+        if delay is not None:
+            return delay / 1000
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return _parse_duration(headers.get("x-ratelimit-reset-requests"))
+
+
+def _backoff(attempt):
+    return min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+class Cooldown:
+    # Shared by all workers of one batch: when the deployment says "slow down",
+    # everyone pauses instead of each worker burning its own retries.
+    def __init__(self):
+        self._until = 0.0
+        self._lock = threading.Lock()
+
+    def push(self, seconds):
+        with self._lock:
+            self._until = max(self._until, time.monotonic() + seconds)
+
+    def wait(self):
+        while True:
+            with self._lock:
+                delay = self._until - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def observe(self, headers):
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        if remaining is not None and remaining.strip() == "0":
+            reset = _parse_duration(headers.get("x-ratelimit-reset-requests"))
+            if reset:
+                self.push(reset)
+
+
+def generate_image(prompt, api_key, url=DALLE_URL, size="1024x1024", cooldown=None,
+                   max_attempts=MAX_ATTEMPTS, timeout=60, deployment=DALLE_DEPLOYMENT, priority=INTERACTIVE):
+    """Generate one image and return its URL, or None after max_attempts."""
+    cooldown = cooldown or Cooldown()
+    bucket = get_bucket(deployment)
+    headers = {"Content-Type": "application/json", "api-key": api_key}
+    payload = {"prompt": prompt, "n": 1, "size": size}
+    for attempt in range(max_attempts):
+        cooldown.wait()
+        bucket.acquire(priority=priority)
+        try:
+            res = get_session("dalle").post(url, headers=headers, json=payload, timeout=timeout)
+        except requests.RequestException:
+            time.sleep(_backoff(attempt))
+            continue
+        cooldown.observe(res.headers)
+        if res.status_code == 200:
+            try:
+                return res.json()["data"][0]["url"]
+            except (ValueError, KeyError, IndexError):
+                return None
+        if res.status_code == 429 or res.status_code >= 500:
+            delay = retry_delay(res.headers)
+            delay = _backoff(attempt) if delay is None else delay + random.uniform(0, 1)
+            cooldown.push(delay)
+            if res.status_code == 429:
+                bucket.pause(delay)
+            continue
+        # 400s such as content-policy rejections will not succeed on retry.
+        return None
+    return None
+
+
+class ImageBatch:
+    """Worker pool that accepts prompts while they are still being produced.
+
+    Submit each prompt as soon as it is known (e.g. when a slide has streamed
+    in) and collect (index, result) pairs from results() in completion order.
+    result is the image URL (None on failure), or postprocess(index, url) when
+    given; postprocess runs on the worker thread so downloads/uploads overlap
+    with the remaining generations.
+    """
+
+    def __init__(self, api_key, url=DALLE_URL, size="1024x1024", postprocess=None,
+                 max_workers=MAX_WORKERS, priority=INTERACTIVE):
+        self.api_key = api_key
+        self.url = url
+        self.size = size
+        self.postprocess = postprocess
+        self.priority = priority
+        self._cooldown = Cooldown()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = {}
+
+    def _work(self, index, prompt):
+        image_url = generate_image(prompt, self.api_key, url=self.url, size=self.size,
+                                   cooldown=self._cooldown, priority=self.priority)
+        return self.postprocess(index, image_url) if self.postprocess else image_url
+
+    def submit(self, index, prompt):
+        self._futures[self._pool.submit(self._work, index, prompt)] = index
+
+    def __len__(self):
+        return len(self._futures)
+
+    def results(self):
+        for future in as_completed(self._futures):
+            yield self._futures[future], future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._pool.shutdown(wait=True)
+
+
+def generate_images(prompts, api_key, url=DALLE_URL, size="1024x1024", postprocess=None,
+                    max_workers=MAX_WORKERS, priority=INTERACTIVE):
+    """Yield (index, result) for each prompt as soon as its slot finishes."""
+    with ImageBatch(api_key, url=url, size=size, postprocess=postprocess,
+                    max_workers=max_workers, priority=priority) as batch:
+        for i, prompt in enumerate(prompts):
+            batch.submit(i, prompt)
+        yield from batch.results()
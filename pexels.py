@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from connections import get_session
+from storage import put_once
+from image_derivatives import SLIDE_SIZE, Rendition, derive
+
+# ===== 📷 Pexels search with a persistent cache =====
+# Query results are kept on disk so repeat keywords (the fixed keyword lists,
+# popular topics) cost no API call across reruns and restarts. Optionally each
+# chosen photo is downloaded once, cropped to the slide size and served from
+# our own bucket instead of Pexels' CDN.
+#
+# Each query is fetched once as a single page of PAGE_SIZE results and
+# de-duplicated, so asking for the i-th or the first n images of a query is a
+# lookup into that one result set rather than another request.
+
+SEARCH_URL = "https://api.pexels.com/v1/search"
+CACHE_DB = os.environ.get("PEXELS_CACHE_DB", os.path.join(tempfile.gettempdir(), "pexels_cache.sqlite"))
+CACHE_TTL = float(os.environ.get("PEXELS_CACHE_TTL", 7 * 24 * 60 * 60))
+PAGE_SIZE = 30
+PHOTO_FIELDS = ("id", "photographer", "photographer_id", "width", "height", "alt", "src")
+PLACEHOLDER_IMAGE = "https://via.placeholder.com/720x1280?text=No+Image"
+WARM_PER_KEYWORD = 5
+WARM_REFRESH = float(os.environ.get("PEXELS_WARM_REFRESH", 6 * 60 * 60))
+
+# s3 client, bucket, key prefix ("" for the bucket root) and the CDN base that serves it.
+Rehost = namedtuple("Rehost", "s3 bucket key_prefix base_url")
+
+
+def _connect():
+    conn = sqlite3.connect(CACHE_DB, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS photo_sets (query TEXT, orientation TEXT,"
+        " fetched REAL, photos TEXT, PRIMARY KEY (query, orientation))"
+    )
+    return conn
+
+
+def _cached(key):
+    conn = _connect()
+    try:
+        return conn.execute(
+            "SELECT fetched, photos FROM photo_sets WHERE query = ? AND orientation = ?", key
+        ).fetchone()
+    finally:
+        conn.close()
+
+
+def _store(key, photos):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO photo_sets VALUES (?, ?, ?, ?)", key + (time.time(), json.dumps(photos)))
+    finally:
+        conn.close()
+
+
+def distinct(photos):
+    """Drop repeated ids, and put one photo per photographer first (their shots are often near-identical)."""
+    seen_ids, seen_photographers, first, rest = set(), set(), [], []
+    for photo in photos:
+        if photo["id"] in seen_ids:
+            continue
+        seen_ids.add(photo["id"])
+        photographer = photo.get("photographer_id") or photo.get("photographer")
+        (rest if photographer in seen_photographers else first).append(photo)
+        seen_photographers.add(photographer)
+    return first + rest
+
+
+def search_photos(query, api_key, orientation="portrait", max_age=CACHE_TTL):
+    """Distinct photo metadata for a query, cached for max_age seconds; [] when nothing is available."""
+    key = (query.strip().lower(), orientation)
+    row = _cached(key)
+    if row and time.time() - row[0] < max_age:
+        return json.loads(row[1])
+    try:
+        res = get_session("pexels").get(
+            SEARCH_URL,
+            headers={"Authorization": api_key},
+            params={"query": query, "per_page": PAGE_SIZE, "orientation": orientation},
+            timeout=8,
+        )
+        res.raise_for_status()
+        photos = distinct([{k: p.get(k) for k in PHOTO_FIELDS} for p in res.json().get("photos", [])])
+    except Exception:
+        # Serve a stale result over nothing.
+        return json.loads(row[1]) if row else []
+    _store(key, photos)
+    return photos
+
+
+def photo_url(photo, rehost=None):
+    """URL to embed for a photo: Pexels' portrait crop, or our re-hosted slide-size copy."""
+    src = photo["src"]["portrait"]
+    if rehost is None:
+        return src
+    name = f"pexels/{photo['id']}-{SLIDE_SIZE[0]}x{SLIDE_SIZE[1]}.jpg"
+    key = f"{rehost.key_prefix}/{name}" if rehost.key_prefix else name
+
+    def build():
+        slide = Rendition("slide", SLIDE_SIZE, fit=True)
+        return derive(get_session("cdn").get(src, timeout=15).content, [slide])[slide]
+
+    try:
+        put_once(rehost.s3, rehost.bucket, key, build, "image/jpeg")
+    except Exception:
+        return src
+    return f"{rehost.base_url}/{name}"
+
+
+def search_image_urls(query, api_key, n, rehost=None, placeholder=PLACEHOLDER_IMAGE):
+    """n image URLs for a query from one search; photos repeat when fewer than n exist."""
+    photos = search_photos(query, api_key)
+    if not photos:
+        return [placeholder] * n
+    chosen = [photos[i % len(photos)] for i in range(n)]
+    if rehost is None:
+        return [photo_url(photo) for photo in chosen]
+    with ThreadPoolExecutor(max_workers=min(n, 5)) as pool:
+        return list(pool.map(lambda photo: photo_url(photo, rehost), chosen))
+
+
+def search_image_url(query, api_key, index=0, rehost=None, placeholder=PLACEHOLDER_IMAGE):
+    """The index-th distinct image for a query (the last one if there are fewer)."""
+    photos = search_photos(query, api_key)
+    if not photos:
+        return placeholder
+    return photo_url(photos[min(index, len(photos) - 1)], rehost)
+
+
+# ===== 🔥 Warm keyword pools =====
+# Apps with a fixed keyword list get their candidate images loaded once per
+# process in the background (and refreshed periodically), so picking images
+# for a story is a dictionary lookup. A refresh searches again once the cached
+# result is older than the refresh interval, and each round takes the next
+# photos of the result so the candidates rotate through the whole page.
+
+class KeywordPool:
+    def __init__(self, keywords, api_key, per_keyword=WARM_PER_KEYWORD, rehost=None, refresh=WARM_REFRESH):
+        self.keywords = list(keywords)
+        self.api_key = api_key
+        self.per_keyword = per_keyword
+        self.rehost = rehost
+        self.refresh = refresh
+        self._candidates = {}
+        self._round = 0
+        self._thread = threading.Thread(target=self._run, name="pexels-warmup", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            for keyword in self.keywords:
+                try:
+                    photos = search_photos(keyword, self.api_key, max_age=self.refresh)
+                    urls = [photo_url(photo, self.rehost) for photo in self._window(photos)]
+                except Exception:
+                    continue
+                if urls:
+                    self._candidates[keyword] = urls
+            self._round += 1
+            time.sleep(self.refresh)
+
+    def _window(self, photos):
+        # This round's per_keyword photos, wrapping around the result.
+        count = min(self.per_keyword, len(photos))
+        start = self._round * self.per_keyword
+        return [photos[(start + i) % len(photos)] for i in range(count)]
+
+    def pick(self, keyword):
+        """A random warmed image for the keyword; searches inline if it isn't warm yet."""
+        urls = self._candidates.get(keyword)
+        if urls:
+            return random.choice(urls)
+        return search_image_url(keyword, self.api_key, rehost=self.rehost)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def keyword_pool(keywords, api_key, rehost=None):
+    """The process-wide KeywordPool for this keyword list, started on first use."""
+    key = (tuple(keywords), api_key, rehost)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = KeywordPool(keywords, api_key, rehost=rehost)
+        return _pools[key]
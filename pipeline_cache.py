@@ -0,0 +1,130 @@
+import time
+import threading
+from collections import OrderedDict
+
+# ===== ♻️ Rerun-proof pipeline cache =====
+# Streamlit re-executes the whole script on every widget change, but imported
+# modules stay loaded for the lifetime of the server process, so anything kept
+# here is shared by every session.
+
+class TTLCache:
+    def __init__(self, maxsize=128, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+
+_MISSING = object()
+
+# DALL·E result URLs expire after a few hours, so keep entries well below that.
+PIPELINE_STORE = TTLCache(maxsize=256, ttl=60 * 60)
+SESSION_KEY = "_pipeline_cache"
+SESSION_VALUES_KEY = "_pipeline_session_values"
+SESSION_MAXSIZE = 8
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _key_lock(key):
+    with _inflight_lock:
+        return _inflight.setdefault(key, threading.Lock())
+
+
+def _release_key_lock(key, lock):
+    # Forget the lock once nobody holds it, so _inflight doesn't grow with
+    # every key ever computed. A late waiter on the old lock still finds the
+    # stored result.
+    with _inflight_lock:
+        if _inflight.get(key) is lock and not lock.locked():
+            del _inflight[key]
+
+
+def _session_cache(session_state, name, ttl):
+    if name not in session_state:
+        session_state[name] = TTLCache(maxsize=SESSION_MAXSIZE, ttl=ttl)
+    return session_state[name]
+
+
+def cached_pipeline(session_state, key, compute, store=PIPELINE_STORE, should_cache=bool):
+    """Return compute() for key, reusing the session copy, then the process store.
+
+    Concurrent sessions asking for the same key wait for the first one instead
+    of running the pipeline twice. Results rejected by should_cache are returned
+    but never stored, so failures are retried on the next rerun.
+    """
+    session_cache = _session_cache(session_state, SESSION_KEY, store.ttl)
+
+    value = session_cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    lock = _key_lock(key)
+    try:
+        with lock:
+            value = store.get(key, _MISSING)
+            if value is _MISSING:
+                value = compute()
+                if not should_cache(value):
+                    return value
+                store.set(key, value)
+    finally:
+        _release_key_lock(key, lock)
+    session_cache.set(key, value)
+    return value
+
+
+def session_value(session_state, key, make, ttl=PIPELINE_STORE.ttl):
+    """make() once per session and key; never shared through the process store.
+
+    For things that must differ between users of the same cached pipeline,
+    such as the slug and S3 key a story is published under.
+    """
+    values = _session_cache(session_state, SESSION_VALUES_KEY, ttl)
+    value = values.get(key, _MISSING)
+    if value is _MISSING:
+        value = make()
+        values.set(key, value)
+    return value
+
+
+def invalidate(session_state, key, store=PIPELINE_STORE):
+    store.pop(key)
+    for name in (SESSION_KEY, SESSION_VALUES_KEY):
+        if name in session_state:
+            session_state[name].pop(key)
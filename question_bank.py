@@ -0,0 +1,127 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import tempfile
+from question_salvage import valid_question
+
+# ===== 🏦 Question bank =====
+# Every question we generate is kept in a local SQLite bank with an FTS5 index
+# over its text, topic and options. In reuse-first mode a quiz is assembled
+# from banked questions filed under the topic that haven't been used recently,
+# and only the shortfall goes to GPT. Questions are banked as used, since they
+# were just served, so they only come back once REUSE_COOLDOWN has passed.
+#
+# Questions are de-duplicated on their normalized text, so the same question
+# generated twice (or under two topics) is stored once.
+
+BANK_DB = os.environ.get("QUESTION_BANK_DB", os.path.join(tempfile.gettempdir(), "question_bank.sqlite"))
+REUSE_COOLDOWN = float(os.environ.get("QUESTION_REUSE_COOLDOWN", 24 * 60 * 60))
+
+_fts_available = None
+
+
+def _connect():
+    global _fts_available
+    conn = sqlite3.connect(BANK_DB, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS questions (id INTEGER PRIMARY KEY, text_key TEXT UNIQUE,"
+        " topic TEXT, question TEXT, options TEXT, correct_index INTEGER, created REAL, last_used REAL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS questions_topic ON questions (topic)")
+    if _fts_available is not False:
+        try:
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(question, topic, options)")
+            _fts_available = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: fall back to exact topic lookups.
+            _fts_available = False
+    return conn
+
+
+def _topic(topic):
+    return " ".join(topic.lower().split())
+
+
+def _match_query(topic):
+    # Only the topic column counts: a question that merely mentions the word
+    # belongs to another topic. Every word is quoted so topics like "AND" or
+    # "C++" can't be read as FTS syntax.
+    words = " ".join('"' + word.replace('"', '""') + '"' for word in re.findall(r"\w+", topic))
+    return f"topic : ({words})" if words else ""
+
+
+def _row_question(row):
+    return {"question": row[1], "options": json.loads(row[2]), "correct_index": row[3]}
+
+
+def save_questions(topic, questions):
+    """Bank questions that were just served for a topic; returns how many were new."""
+    added = 0
+    now = time.time()
+    try:
+        conn = _connect()
+    except sqlite3.Error:
+        return 0
+    try:
+        with conn:
+            for q in questions:
+                if not valid_question(q):
+                    continue
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO questions (text_key, topic, question, options, correct_index, created, last_used)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (" ".join(q["question"].lower().split()), _topic(topic), q["question"],
+                     json.dumps(q["options"]), q["correct_index"], now, now),
+                )
+                if not cur.rowcount:
+                    continue
+                added += 1
+                if _fts_available:
+                    conn.execute(
+                        "INSERT INTO questions_fts (rowid, question, topic, options) VALUES (?, ?, ?, ?)",
+                        (cur.lastrowid, q["question"], _topic(topic), " ".join(q["options"])),
+                    )
+    except sqlite3.Error:
+        pass
+    finally:
+        conn.close()
+    return added
+
+
+def reusable_questions(topic, n, cooldown=REUSE_COOLDOWN):
+    """Up to n banked questions for a topic not used in the last `cooldown` seconds, marked as used now."""
+    if n <= 0:
+        return []
+    now = time.time()
+    try:
+        conn = _connect()
+    except sqlite3.Error:
+        return []
+    try:
+        if _fts_available:
+            query = _match_query(topic)
+            if not query:
+                return []
+            rows = conn.execute(
+                "SELECT q.id, q.question, q.options, q.correct_index FROM questions_fts"
+                " JOIN questions q ON q.id = questions_fts.rowid"
+                " WHERE questions_fts MATCH ? AND (q.last_used IS NULL OR q.last_used < ?)"
+                " ORDER BY bm25(questions_fts), q.last_used IS NOT NULL, q.last_used LIMIT ?",
+                (query, now - cooldown, n),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT id, question, options, correct_index FROM questions"
+                " WHERE topic = ? AND (last_used IS NULL OR last_used < ?)"
+                " ORDER BY last_used IS NOT NULL, last_used LIMIT ?",
+                (_topic(topic), now - cooldown, n),
+            ).fetchall()
+        with conn:
+            conn.executemany("UPDATE questions SET last_used = ? WHERE id = ?", [(now, row[0]) for row in rows])
+    except sqlite3.Error:
+        return []
+    finally:
+        conn.close()
+    return [_row_question(row) for row in rows]
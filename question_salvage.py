@@ -0,0 +1,74 @@
+# ===== 🩹 Salvage and top-up for generated questions =====
+# Questions are collected one by one as they stream in, so a truncated or
+# partly broken response still yields every complete question that is valid
+# (after contracts.normalize_question's repairs). When
+# fewer than needed survive, a small follow-up asks for just the missing
+# count, listing the ones we already have so they are not repeated.
+
+from contracts import normalize_question
+
+MAX_TOP_UPS = 2
+
+
+def valid_question(q):
+    return bool(
+        isinstance(q, dict)
+        and isinstance(q.get("question"), str) and q["question"].strip()
+        and isinstance(q.get("options"), list) and len(q["options"]) == 4
+        and all(isinstance(o, str) and o.strip() for o in q["options"])
+        and isinstance(q.get("correct_index"), int) and 0 <= q["correct_index"] < 4
+    )
+
+
+def _question_key(q):
+    return " ".join(q["question"].lower().split())
+
+
+class QuestionCollector:
+    """on_item callback for stream_json that keeps valid, distinct questions."""
+
+    def __init__(self, on_question=None):
+        self.questions = []
+        self.on_question = on_question
+        self._seen = set()
+
+    def __call__(self, item):
+        question = normalize_question(item)
+        if question is None or _question_key(question) in self._seen:
+            return
+        self._seen.add(_question_key(question))
+        self.questions.append(question)
+        if self.on_question:
+            self.on_question(question)
+
+
+def avoid_instruction(existing):
+    if not existing:
+        return ""
+    listed = "\n".join(f"- {q['question']}" for q in existing)
+    return f" Do not repeat or rephrase any of these existing questions:\n{listed}\n"
+
+
+def collect_questions(n, request, on_question=None, max_top_ups=MAX_TOP_UPS, seed=()):
+    """Up to n valid questions from request(count, existing, collector), topping up what is missing.
+
+    request streams `count` new questions into the collector; any exception it
+    raises midway keeps whatever already arrived. seed questions (e.g. from the
+    question bank) are taken first, and request is only called for the rest.
+    """
+    collector = QuestionCollector(on_question)
+    for question in seed:
+        collector(question)
+    for _ in range(1 + max_top_ups):
+        missing = n - len(collector.questions)
+        if missing <= 0:
+            break
+        before = len(collector.questions)
+        try:
+            request(missing, list(collector.questions), collector)
+        except Exception:
+            pass
+        if len(collector.questions) == before and before:
+            # The follow-up produced nothing usable; don't keep paying for it.
+            break
+    return collector.questions[:n]
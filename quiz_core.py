@@ -0,0 +1,172 @@
+import os
+import random
+import string
+from rate_limiter import INTERACTIVE, acquire
+from connections import get_s3_client
+from storage import IMMUTABLE_CACHE_CONTROL, put_html
+from pexels import Rehost, search_image_urls
+from streaming import post_chat, stream_json
+from contracts import QUESTIONS, QUIZ
+from question_salvage import avoid_instruction, collect_questions
+from question_bank import reusable_questions, save_questions
+from templates import get_template
+from vision_input import image_content
+from image_engine import DALLE_URL, generate_images
+
+# ===== 🧠 Headless quiz generation =====
+# Everything here runs without a Streamlit session so the same functions back
+# the keyword, DALL·E and image-based quiz apps and the batch runner
+# (batch_generate.py).
+
+def _secret(name):
+    # Environment first, so batch jobs can run without a secrets.toml.
+    if name in os.environ:
+        return os.environ[name]
+    try:
+        import streamlit as st
+        return st.secrets[name]
+    except Exception:
+        return None
+
+AZURE_API_KEY     = _secret("AZURE_API_KEY")
+AZURE_ENDPOINT    = _secret("AZURE_ENDPOINT")
+AZURE_DEPLOYMENT  = _secret("AZURE_DEPLOYMENT")
+AZURE_API_VERSION = _secret("AZURE_API_VERSION")
+PEXELS_API_KEY    = _secret("PEXELS_API_KEY")
+DAALE_KEY         = _secret("DAALE_KEY")
+
+AWS_ACCESS_KEY = _secret("AWS_ACCESS_KEY")
+AWS_SECRET_KEY = _secret("AWS_SECRET_KEY")
+AWS_REGION     = _secret("AWS_REGION")
+AWS_BUCKET     = _secret("AWS_BUCKET")
+S3_PREFIX      = "suvichaarstories"
+DISPLAY_BASE   = "https://suvichaar.org/stories"  # <-- for final output link
+
+PLACEHOLDER_IMAGE = "https://via.placeholder.com/720x1280?text=No+Image"
+
+# Optional: serve Pexels photos from our bucket instead of hot-linking them.
+PEXELS_REHOST = (
+    Rehost(get_s3_client(AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_REGION), AWS_BUCKET, S3_PREFIX, DISPLAY_BASE)
+    if _secret("PEXELS_REHOST") else None
+)
+
+def generate_slug_and_urls():
+    nano = ''.join(random.choices(string.ascii_letters + string.digits, k=10)) + '_G'
+    slug_full = f"generated-quiz_{nano}"
+    s3_key = f"{S3_PREFIX}/{slug_full}.html"
+    display_url = f"{DISPLAY_BASE}/{slug_full}.html"
+    return slug_full, s3_key, display_url
+
+def search_pexels_images(query, n=5):
+    return search_image_urls(query, PEXELS_API_KEY, n, rehost=PEXELS_REHOST, placeholder=PLACEHOLDER_IMAGE)
+
+def generate_dalle_images(prompt, n=5, priority=INTERACTIVE, slots=None):
+    # Only the given slots (all by default) get a DALL·E image; the rest keep the placeholder.
+    image_urls = [PLACEHOLDER_IMAGE] * n
+    slots = list(range(n)) if slots is None else slots
+    for i, image_url in generate_images([prompt] * len(slots), DAALE_KEY, url=DALLE_URL, priority=priority):
+        if image_url:
+            image_urls[slots[i]] = image_url
+    return image_urls
+
+def _chat_endpoint():
+    return f"{AZURE_ENDPOINT}/openai/deployments/{AZURE_DEPLOYMENT}/chat/completions?api-version={AZURE_API_VERSION}"
+
+def analyze_keyword_with_gpt(keyword, context_prompt, n=5, on_question=None, priority=INTERACTIVE, reuse=False):
+    """Up to n valid questions; a short or broken response is topped up rather than padded.
+
+    With reuse, banked questions for the keyword come first and GPT only
+    writes the shortfall. New questions are always added to the bank.
+    """
+    headers = {"api-key": AZURE_API_KEY, "Content-Type": "application/json"}
+
+    def request(count, existing, collector):
+        messages = [
+            {"role": "system", "content": [{"type": "text", "text": context_prompt}]},
+            {"role": "user", "content": [
+                {"type": "text", "text":
+                    f"Using the topic: '{keyword}', generate {count} different MCQ questions (suitable for a quiz) with 4 options each, correct_index for each, and return only valid JSON like: "
+                    '{"questions": [{"question": ..., "options": [...], "correct_index": ...}, ...]}. No extra text.'
+                    + avoid_instruction(existing)}
+            ]}
+        ]
+        payload = {"messages": messages, "temperature": 0.7, "max_tokens": 280 * count, "stream": True,
+                   "response_format": QUESTIONS.response_format}
+        acquire(AZURE_DEPLOYMENT, payload, priority=priority)
+        res = post_chat(_chat_endpoint(), headers, payload)
+        if res.status_code == 200:
+            stream_json(res, on_item=collector)
+
+    banked = reusable_questions(keyword, n) if reuse else []
+    questions = collect_questions(n, request, on_question=on_question, seed=banked)
+    save_questions(keyword, [q for q in questions if q not in banked])
+    return questions
+
+IMAGE_QUIZ_INSTRUCTIONS = (
+    "Generate 5 MCQ questions with 4 options each, correct_index, a title, cover_heading, cover_subtext, "
+    "and results_text. Return ONLY valid JSON. No extra text."
+)
+# For IMAGE_QUIZ: focus_keyword streams first, so image searches can start early.
+FOCUS_KEYWORD_INSTRUCTIONS = (
+    "First give focus_keyword: a single lowercase educational keyword (e.g., 'books', 'exam', 'paper', 'notes') "
+    "that best represents this image. Then generate 5 MCQ questions with 4 options each, correct_index, a title, "
+    "cover_heading, cover_subtext, and results_text. Return ONLY valid JSON. No extra text."
+)
+
+def analyze_image_with_gpt(image_bytes, context_prompt, detail="high", on_question=None, on_field=None,
+                           priority=INTERACTIVE, contract=QUIZ, instructions=IMAGE_QUIZ_INSTRUCTIONS):
+    """Quiz JSON for an uploaded image, or None when the call or parsing fails."""
+    headers = {"api-key": AZURE_API_KEY, "Content-Type": "application/json"}
+    messages = [
+        {"role": "system", "content": [{"type": "text", "text": context_prompt}]},
+        {"role": "user", "content": [
+            {"type": "text", "text": instructions},
+            image_content(image_bytes, detail=detail)
+        ]}
+    ]
+    payload = {"messages": messages, "temperature": 0.7, "max_tokens": 1800, "stream": True,
+               "response_format": contract.response_format}
+    acquire(AZURE_DEPLOYMENT, payload, priority=priority)
+    res = post_chat(_chat_endpoint(), headers, payload)
+    if res.status_code != 200:
+        return None
+    try:
+        return contract.parse(stream_json(res, on_item=on_question, on_field=on_field))
+    except Exception:
+        return None
+
+def render_quiz_html(data, image_urls, template_str, results_bg=None, confetti="📚"):
+    """image_urls: cover, then one per question slide (results 1-4 reuse slides 1-4)."""
+    template = get_template(template_str)
+    html_data = {
+        "pagetitle": data.get("title", "Untitled Quiz"),
+        "storytitle": data.get("title", "Untitled Quiz"),
+        "typeofquiz": "Auto Quiz",
+        "potraitcoverurl": image_urls[0],
+        "s1image1": image_urls[0],         # Cover
+        "s1title1": data.get("cover_heading", "Test Your Knowledge!"),
+        "s1text1": data.get("cover_subtext", "Let's see how well you can guess."),
+        "results_bg_image": results_bg or image_urls[0],
+        "results_prompt_text": data.get("results_text", "You've completed the quiz!"),
+        "results1_image": image_urls[1], "results1_category": "Expert", "results1_text": "Incredible! You're a quiz master.",
+        "results2_image": image_urls[2], "results2_category": "Smart Thinker", "results2_text": "Nice! You did well.",
+        "results3_image": image_urls[3], "results3_category": "Explorer", "results3_text": "You're learning fast!",
+        "results4_image": image_urls[4], "results4_category": "Beginner", "results4_text": "Keep trying, you'll get there!"
+    }
+    for i, q in enumerate(data.get("questions", []), start=2):
+        html_data[f"s{i}image1"] = image_urls[i-1] if i-1 < len(image_urls) else image_urls[0]
+        html_data[f"s{i}question1"] = q.get("question", f"Question {i - 1}")
+        options = q.get("options", [f"Option {k}" for k in range(1, 5)])
+        correct_index = q.get("correct_index", 0)
+        html_data[f"s{i}correct_index"] = correct_index
+        for j in range(1, 5):
+            html_data[f"s{i}option{j}"] = options[j - 1]
+            if (j - 1) == correct_index:
+                html_data[f"s{i}option{j}attr"] = f'option-{j}-correct option-{j}-confetti="{confetti}"'
+            else:
+                html_data[f"s{i}option{j}attr"] = ""
+    return template.render(**html_data)
+
+def upload_to_s3(content_str, s3_key, cache_control=IMMUTABLE_CACHE_CONTROL):
+    s3 = get_s3_client(AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_REGION)
+    put_html(s3, AWS_BUCKET, s3_key, content_str, cache_control=cache_control)
@@ -0,0 +1,209 @@
+import os
+import time
+import heapq
+import sqlite3
+import itertools
+import threading
+
+# ===== 🚦 Cross-session rate limiting for Azure deployments =====
+# Every Streamlit session lives in the same server process, so one bucket per
+# deployment here is shared by all editors. Set RATE_LIMIT_DB to a SQLite path
+# to also share the buckets between processes (several servers, batch jobs).
+
+INTERACTIVE = 0
+BULK = 1
+
+DEFAULT_RPM = int(os.environ.get("AZURE_OPENAI_RPM", 60))
+DEFAULT_TPM = int(os.environ.get("AZURE_OPENAI_TPM", 80000))
+# (rpm, tpm, burst_seconds); tpm 0 means "requests only".
+DEFAULT_LIMITS = {
+    "dall-e-3": (int(os.environ.get("DALLE_RPM", 6)), 0, 60),
+}
+BURST_SECONDS = 10
+BULK_RESERVE = 0.25      # share of each bucket bulk jobs may not dip into
+IMAGE_TOKENS = 765       # rough cost of one high-detail image input
+LOW_DETAIL_TOKENS = 85
+
+
+def estimate_tokens(payload):
+    """Prompt tokens (~4 chars each, images at a flat rate) plus max_tokens."""
+    chars, image_tokens = 0, 0
+    for message in payload.get("messages", []):
+        content = message.get("content", "")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content:
+            if part.get("type") == "text":
+                chars += len(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                image_tokens += LOW_DETAIL_TOKENS if part["image_url"].get("detail") == "low" else IMAGE_TOKENS
+    return chars // 4 + image_tokens + payload.get("max_tokens", 0)
+
+
+class _MemoryState:
+    def __init__(self, capacity):
+        self.levels = list(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.clock = time.monotonic
+
+    def transact(self, fn):
+        return fn(self)
+
+
+class _SQLiteState:
+    # Same interface as _MemoryState, but each transaction re-reads and writes
+    # one row under BEGIN IMMEDIATE so concurrent processes serialize on it.
+    def __init__(self, path, name, capacity):
+        self.path = path
+        self.name = name
+        self.clock = time.time
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, requests REAL,"
+                " tokens REAL, updated REAL, blocked_until REAL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO buckets VALUES (?, ?, ?, ?, 0)",
+                (name, capacity[0], capacity[1], self.clock()),
+            )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def transact(self, fn):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT requests, tokens, updated, blocked_until FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            self.levels, self.updated, self.blocked_until = [row[0], row[1]], row[2], row[3]
+            result = fn(self)
+            conn.execute(
+                "UPDATE buckets SET requests = ?, tokens = ?, updated = ?, blocked_until = ? WHERE name = ?",
+                (self.levels[0], self.levels[1], self.updated, self.blocked_until, self.name),
+            )
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+
+class TokenBucket:
+    """Requests-per-minute and tokens-per-minute bucket with priority lanes.
+
+    Waiters are served strictly by (priority, arrival); BULK callers also leave
+    BULK_RESERVE of the bucket untouched so interactive sessions that arrive
+    later never queue behind a backfill.
+    """
+
+    def __init__(self, name, rpm, tpm=0, burst_seconds=BURST_SECONDS, db_path=None):
+        self.name = name
+        self.rates = (rpm / 60.0, tpm / 60.0)
+        self.capacity = (max(1.0, self.rates[0] * burst_seconds), self.rates[1] * burst_seconds)
+        if db_path:
+            self._state = _SQLiteState(db_path, name, self.capacity)
+        else:
+            self._state = _MemoryState(self.capacity)
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def _refill(self, state):
+        now = state.clock()
+        elapsed = max(0.0, now - state.updated)
+        state.levels = [
+            min(cap, level + rate * elapsed)
+            for level, rate, cap in zip(state.levels, self.rates, self.capacity)
+        ]
+        state.updated = now
+        return now
+
+    def _try_take(self, cost, priority):
+        # Returns 0 when taken, else the seconds until capacity should exist.
+        def take(state):
+            now = self._refill(state)
+            if state.blocked_until > now:
+                return state.blocked_until - now
+            reserve = BULK_RESERVE if priority == BULK else 0.0
+            waits = []
+            for level, need, rate, cap in zip(state.levels, cost, self.rates, self.capacity):
+                if not rate:
+                    continue
+                # A single request larger than the bucket only needs a full bucket.
+                need = min(need + reserve * cap, cap)
+                if level < need:
+                    waits.append((need - level) / rate)
+            if waits:
+                return max(waits)
+            state.levels = [level - min(need, cap) if rate else level
+                            for level, need, rate, cap in zip(state.levels, cost, self.rates, self.capacity)]
+            return 0.0
+        return self._state.transact(take)
+
+    def acquire(self, tokens=0, priority=INTERACTIVE, timeout=None):
+        """Block until one request (and `tokens` tokens) may be sent."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        entry = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    if self._waiters[0] == entry:
+                        delay = self._try_take((1, tokens), priority)
+                        if not delay:
+                            return True
+                    else:
+                        delay = 0.05
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                        delay = min(delay, remaining)
+                    # Woken early when the head of the queue changes.
+                    self._cond.wait(min(delay, 1.0))
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def pause(self, seconds):
+        """Hold every caller back, e.g. after the service answered 429 anyway."""
+        def block(state):
+            state.blocked_until = max(state.blocked_until, state.clock() + seconds)
+        with self._cond:
+            self._state.transact(block)
+            self._cond.notify_all()
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(deployment, rpm=None, tpm=None):
+    with _buckets_lock:
+        bucket = _buckets.get(deployment)
+        if bucket is None:
+            default_rpm, default_tpm, burst = DEFAULT_LIMITS.get(deployment, (DEFAULT_RPM, DEFAULT_TPM, BURST_SECONDS))
+            bucket = TokenBucket(
+                deployment,
+                rpm or default_rpm,
+                default_tpm if tpm is None else tpm,
+                burst_seconds=burst,
+                db_path=os.environ.get("RATE_LIMIT_DB"),
+            )
+            _buckets[deployment] = bucket
+        return bucket
+
+
+def acquire(deployment, payload=None, priority=INTERACTIVE, timeout=None):
+    tokens = estimate_tokens(payload) if payload else 0
+    return get_bucket(deployment).acquire(tokens, priority=priority, timeout=timeout)
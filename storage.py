@@ -0,0 +1,184 @@
+import os
+import gzip
+import json
+import hashlib
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from pipeline_cache import TTLCache
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is used instead
+    brotli = None
+
+# ===== ☁️ S3 publishing =====
+# Bodies go straight from memory to put_object (no temp files on the host),
+# with the headers the CDN and browsers need. Stories are 30–80 KB of very
+# repetitive AMP markup, so a precompressed body is typically 5–10x smaller
+# when compression is enabled.
+
+HTML_CONTENT_TYPE = "text/html; charset=utf-8"
+JSON_CONTENT_TYPE = "application/json; charset=utf-8"
+# Generated story keys carry a random slug, so their content never changes.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# For keys that get republished in place (editing a quiz and uploading again).
+REPUBLISH_CACHE_CONTROL = "public, max-age=60, s-maxage=300"
+# Bodies are stored uncompressed unless HTML_CONTENT_ENCODING opts in with
+# "gzip" or "br": a precompressed object is served with that Content-Encoding
+# to every client, so only enable it once the CDN in front of the bucket is
+# known to pass it through (or decompress for clients that don't accept it).
+HTML_ENCODING = os.environ.get("HTML_CONTENT_ENCODING") or None
+
+
+def compress(body, encoding):
+    """Return (body, Content-Encoding) for the requested encoding."""
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=11, mode=brotli.MODE_TEXT), "br"
+    if encoding in ("gzip", "br"):
+        return gzip.compress(body, compresslevel=9, mtime=0), "gzip"
+    return body, None
+
+
+def _prepare(body, content_type, cache_control, encoding):
+    body, content_encoding = compress(body, encoding)
+    extra = {"ContentType": content_type}
+    if cache_control:
+        extra["CacheControl"] = cache_control
+    if content_encoding:
+        extra["ContentEncoding"] = content_encoding
+    return body, extra
+
+
+def put_bytes(s3, bucket, key, body, content_type, cache_control=None, encoding=None):
+    body, extra = _prepare(body, content_type, cache_control, encoding)
+    s3.put_object(Bucket=bucket, Key=key, Body=body, **extra)
+
+
+def put_html(s3, bucket, key, html, cache_control=IMMUTABLE_CACHE_CONTROL, encoding=HTML_ENCODING):
+    put_bytes(s3, bucket, key, html.encode("utf-8"), HTML_CONTENT_TYPE, cache_control, encoding)
+
+
+def put_json(s3, bucket, key, data, cache_control=IMMUTABLE_CACHE_CONTROL, encoding=HTML_ENCODING):
+    body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    put_bytes(s3, bucket, key, body, JSON_CONTENT_TYPE, cache_control, encoding)
+
+
+# ===== 🖼️ Content-addressed media =====
+# Media keys are derived from a hash of the bytes, so the same image uploaded
+# on every rerun maps to one object (and one warm CDN entry). Keys known to
+# exist are remembered per process; otherwise a HEAD decides.
+
+MEDIA_EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp", "image/avif": ".avif"}
+
+_known_keys = TTLCache(maxsize=4096, ttl=24 * 60 * 60)
+
+
+def media_key(body, content_type, prefix="media"):
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    return f"{prefix}/{digest}{MEDIA_EXTENSIONS.get(content_type, '')}"
+
+
+def object_exists(s3, bucket, key):
+    if (bucket, key) in _known_keys:
+        return True
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+    except ClientError:
+        # 404, or 403 without s3:ListBucket; either way, upload.
+        return False
+    _known_keys.set((bucket, key), True)
+    return True
+
+
+def put_once(s3, bucket, key, build, content_type):
+    """Upload build() to an immutable key unless it is already stored; returns True if uploaded."""
+    if object_exists(s3, bucket, key):
+        return False
+    put_bytes(s3, bucket, key, build(), content_type, IMMUTABLE_CACHE_CONTROL)
+    _known_keys.set((bucket, key), True)
+    return True
+
+
+def put_media(s3, bucket, body, content_type="image/jpeg", prefix="media"):
+    """Store bytes under a content-addressed key, skipping the upload if it already exists."""
+    key = media_key(body, content_type, prefix)
+    put_once(s3, bucket, key, lambda: body, content_type)
+    return key
+
+
+# ===== 🚚 Parallel asset publishing =====
+# One pool shared by every session: uploads start the moment an artifact is
+# ready and run while the pipeline keeps generating the next one. Large
+# objects are split into parts by the transfer manager.
+
+PUBLISH_WORKERS = 8
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=4,
+    use_threads=True,
+)
+
+_publish_pool = ThreadPoolExecutor(max_workers=PUBLISH_WORKERS, thread_name_prefix="publish")
+
+
+class Publisher:
+    """Uploads the artifacts of one story in parallel and collects their CDN URLs.
+
+    add() returns immediately with the URL the object will have; wait() blocks
+    until everything added so far is stored. Keys are relative to base_url;
+    key_prefix is prepended in the bucket only, for CDNs that map their root
+    to a folder of the bucket.
+    """
+
+    def __init__(self, s3, bucket, base_url, key_prefix=""):
+        self.s3 = s3
+        self.bucket = bucket
+        self.base_url = base_url.rstrip("/")
+        self.key_prefix = key_prefix.strip("/")
+        self._futures = {}
+
+    def url(self, key):
+        return f"{self.base_url}/{key}"
+
+    def s3_key(self, key):
+        return f"{self.key_prefix}/{key}" if self.key_prefix else key
+
+    def _upload(self, key, body, extra):
+        self.s3.upload_fileobj(BytesIO(body), self.bucket, self.s3_key(key), ExtraArgs=extra, Config=TRANSFER_CONFIG)
+        return self.url(key)
+
+    def add(self, name, key, body, content_type, cache_control=IMMUTABLE_CACHE_CONTROL, encoding=None):
+        body, extra = _prepare(body, content_type, cache_control, encoding)
+        self._futures[name] = _publish_pool.submit(self._upload, key, body, extra)
+        return self.url(key)
+
+    def add_media(self, name, body, content_type="image/jpeg", prefix="media"):
+        """Content-addressed upload via put_media's key; skipped when already stored."""
+        key = media_key(body, content_type, prefix)
+
+        def upload():
+            put_once(self.s3, self.bucket, self.s3_key(key), lambda: body, content_type)
+            return self.url(key)
+
+        self._futures[name] = _publish_pool.submit(upload)
+        return self.url(key)
+
+    def add_html(self, name, key, html, cache_control=IMMUTABLE_CACHE_CONTROL, encoding=HTML_ENCODING):
+        return self.add(name, key, html.encode("utf-8"), HTML_CONTENT_TYPE, cache_control, encoding)
+
+    def add_json(self, name, key, data, cache_control=IMMUTABLE_CACHE_CONTROL, encoding=HTML_ENCODING):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        return self.add(name, key, body, JSON_CONTENT_TYPE, cache_control, encoding)
+
+    def wait(self):
+        """Return ({name: url} for stored artifacts, {name: exception} for failed ones)."""
+        done, failed = {}, {}
+        for name, future in list(self._futures.items()):
+            try:
+                done[name] = future.result()
+            except Exception as e:
+                failed[name] = e
+        return done, failed
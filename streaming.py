@@ -0,0 +1,150 @@
+import json
+from connections import get_session
+
+# ===== 📡 Streaming chat completions =====
+# A streamed response only goes back to the keep-alive pool once its body has
+# been read to EOF, so both the SSE reader and the error path read everything
+# the server sent, and close the response whatever happens.
+
+# Endpoints (deployment + api-version) that rejected a json_schema
+# response_format; later calls to them go without it.
+_no_structured_output = set()
+
+
+def _send(url, headers, payload, session):
+    stream = bool(payload.get("stream"))
+    res = get_session(session).post(url, headers=headers, json=payload, stream=stream)
+    if stream and res.status_code != 200:
+        with res:
+            res.content  # read to EOF; res.text stays available
+    return res
+
+
+def post_chat(url, headers, payload, session="azure"):
+    """POST a chat completion, streaming when the payload asks for it.
+
+    A streamed error response is read in full straight away, so its
+    connection is released even when the caller only looks at status_code.
+    Deployments or API versions that predate structured outputs answer a
+    response_format with a 400; the call is then retried once without it and
+    the contract's local repair and validation take over.
+    """
+    if "response_format" in payload and url in _no_structured_output:
+        payload = {k: v for k, v in payload.items() if k != "response_format"}
+    res = _send(url, headers, payload, session)
+    # Only a 400 that names response_format; content filters and oversized
+    # prompts are 400s too, and retrying those would not help.
+    if res.status_code == 400 and "response_format" in payload and "response_format" in res.text:
+        _no_structured_output.add(url)
+        res = _send(url, headers, {k: v for k, v in payload.items() if k != "response_format"}, session)
+    return res
+
+
+def iter_chat_deltas(res):
+    """Yield content deltas from a `stream=True` chat completions response (SSE)."""
+    done = False
+    with res:
+        for line in res.iter_lines(decode_unicode=True):
+            # Keep reading past [DONE] to the end of the body.
+            if done or not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                done = True
+                continue
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            # Azure sends content-filter chunks with no choices.
+            for choice in chunk.get("choices", []):
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    yield content
+
+
+class IncrementalJSONParser:
+    """Pick complete pieces out of a JSON document while it is still streaming.
+
+    feed() returns events for everything that closed in the new text:
+    ("item", obj) for each object that is an element of an array (a question,
+    a slide) and ("field", key, value) for each finished member of the root
+    object. Text before the root value, such as a code fence, is skipped.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._stack = []          # (opening char, index) of open containers
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+        self._root = None
+        self.done = False
+
+    def feed(self, text):
+        self.buffer += text
+        buf = self.buffer
+        events = []
+        for i in range(self._pos, len(buf)):
+            if self.done:
+                break
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if not self._stack:
+                if ch in "{[":
+                    self._stack.append((ch, i))
+                    self._root = ch
+                    self._member_start = i + 1
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append((ch, i))
+            elif ch == "," and len(self._stack) == 1:
+                self._root_member(buf, i, events)
+            elif ch in "}]":
+                opener, start = self._stack.pop()
+                if not self._stack:
+                    self._root_member(buf, i, events)
+                    self.done = True
+                elif opener == "{" and self._stack[-1][0] == "[":
+                    try:
+                        events.append(("item", json.loads(buf[start:i + 1])))
+                    except ValueError:
+                        pass
+        self._pos = len(buf)
+        return events
+
+    def _root_member(self, buf, end, events):
+        member = buf[self._member_start:end].strip()
+        self._member_start = end + 1
+        if self._root != "{" or not member:
+            return
+        try:
+            (key, value), = json.loads("{" + member + "}").items()
+        except ValueError:
+            return
+        events.append(("field", key, value))
+
+
+def stream_json(res, on_item=None, on_field=None):
+    """Consume a streamed chat response, firing callbacks as pieces complete.
+
+    Returns the full message content for the usual json.loads() at the end.
+    """
+    parser = IncrementalJSONParser()
+    for delta in iter_chat_deltas(res):
+        for event in parser.feed(delta):
+            if event[0] == "item" and on_item:
+                on_item(event[1])
+            elif event[0] == "field" and on_field:
+                on_field(event[1], event[2])
+    return parser.buffer
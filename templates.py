@@ -0,0 +1,75 @@
+import re
+import hashlib
+from jinja2 import Environment, meta
+from jinja2.exceptions import TemplateSyntaxError
+from pipeline_cache import TTLCache
+
+# ===== 🧩 Template registry and analysis =====
+# Uploaded templates are keyed by a hash of their content, so the same AMP
+# file uploaded again (or rendered thousands of times in a batch) is parsed
+# and compiled once per process.
+
+PLACEHOLDER_RE = re.compile(r"\{\{(.*?)\}\}")
+REGISTRY_SIZE = 64
+
+_env = Environment()
+_registry = TTLCache(maxsize=REGISTRY_SIZE, ttl=24 * 60 * 60)
+
+
+def template_hash(template_str):
+    return hashlib.sha256(template_str.encode("utf-8")).hexdigest()
+
+
+def _cached(kind, template_str, build):
+    key = (kind, template_hash(template_str))
+    value = _registry.get(key)
+    if value is None:
+        value = build(template_str)
+        _registry.set(key, value)
+    return value
+
+
+def get_template(template_str):
+    """Compiled Jinja template for this content, drop-in for jinja2.Template(template_str)."""
+    return _cached("jinja", template_str, _env.from_string)
+
+
+def _split_placeholders(template_str):
+    # re.split with one group alternates literal text and the raw placeholder body.
+    parts = PLACEHOLDER_RE.split(template_str)
+    return [(part, part.strip()) if i % 2 else part for i, part in enumerate(parts)]
+
+
+def fill_placeholders(template_str, replacements):
+    """Replace every {{key}} in one pass; unknown keys are left as written."""
+    tokens = _cached("placeholders", template_str, _split_placeholders)
+    out = []
+    for token in tokens:
+        if isinstance(token, str):
+            out.append(token)
+        else:
+            raw, key = token
+            value = replacements.get(key)
+            out.append("{{" + raw + "}}" if value is None else str(value))
+    return "".join(out)
+
+
+def placeholder_variables(template_str):
+    """Keys used by the plain {{key}} format of fill_placeholders_from_html."""
+    tokens = _cached("placeholders", template_str, _split_placeholders)
+    return {token[1] for token in tokens if not isinstance(token, str)}
+
+
+def jinja_variables(template_str):
+    """Top-level variables a Jinja template reads from its render context."""
+    def analyze(source):
+        try:
+            return frozenset(meta.find_undeclared_variables(_env.parse(source)))
+        except TemplateSyntaxError:
+            # Fall back to the plain scan rather than guessing that nothing is used.
+            return frozenset(placeholder_variables(source))
+    return _cached("jinja-vars", template_str, analyze)
+
+
+def uses_any(required, *names):
+    return any(name in required for name in names)
@@ -0,0 +1,127 @@
+import sys
+import math
+import base64
+from io import BytesIO
+from collections import namedtuple
+from PIL import Image, ImageOps
+
+# ===== 🖼️ Vision input preprocessing =====
+# The vision model never looks at more pixels than its tiling allows: "high"
+# detail fits the image into 2048x2048 and then scales the short side down to
+# 768 before cutting 512px tiles; "low" sees a single 512x512 view. Anything
+# beyond that is upload bandwidth we pay for and the service throws away.
+
+HIGH_FIT = 2048
+HIGH_SHORT_SIDE = 768
+LOW_SIDE = 512
+TILE = 512
+BASE_TOKENS = 85
+TILE_TOKENS = 170
+
+DEFAULT_FORMAT = "JPEG"
+DEFAULT_QUALITY = 85
+
+PreparedImage = namedtuple("PreparedImage", "data mime width height detail tokens")
+
+
+def _fit(width, height, limit):
+    scale = min(1.0, limit / max(width, height))
+    return width * scale, height * scale
+
+
+def model_size(width, height, detail="high"):
+    """Size the model actually analyses the image at."""
+    if detail == "low":
+        return _fit(width, height, LOW_SIDE)
+    width, height = _fit(width, height, HIGH_FIT)
+    scale = min(1.0, HIGH_SHORT_SIDE / min(width, height))
+    return width * scale, height * scale
+
+
+def image_tokens(width, height, detail="high"):
+    if detail == "low":
+        return BASE_TOKENS
+    width, height = model_size(width, height, detail)
+    return BASE_TOKENS + TILE_TOKENS * math.ceil(width / TILE) * math.ceil(height / TILE)
+
+
+def prepare_image(image_bytes, detail="high", max_side=None, fmt=DEFAULT_FORMAT, quality=DEFAULT_QUALITY):
+    """Orient, downscale to what the model will see (or max_side) and re-encode."""
+    img = Image.open(BytesIO(image_bytes))
+    width, height = model_size(*img.size, detail=detail)
+    if max_side:
+        width, height = _fit(width, height, max_side)
+    # Let the JPEG decoder skip straight to a coarser DCT scale; the side is
+    # squared because EXIF rotation may still swap width and height.
+    side = math.ceil(max(width, height))
+    img.draft("RGB", (side, side))
+    img = ImageOps.exif_transpose(img)
+
+    width, height = model_size(*img.size, detail=detail)
+    if max_side:
+        width, height = _fit(width, height, max_side)
+    size = (max(1, round(width)), max(1, round(height)))
+    if size != img.size:
+        img = img.resize(size, Image.LANCZOS)
+
+    fmt = fmt.upper()
+    if fmt == "JPEG" and img.mode != "RGB":
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, "white")
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        else:
+            img = img.convert("RGB")
+
+    buffer = BytesIO()
+    if fmt == "JPEG":
+        img.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        img.save(buffer, format=fmt, quality=quality, method=4)
+    return PreparedImage(
+        buffer.getvalue(), f"image/{fmt.lower()}", img.width, img.height, detail,
+        image_tokens(img.width, img.height, detail),
+    )
+
+
+def to_data_url(prepared):
+    return f"data:{prepared.mime};base64,{base64.b64encode(prepared.data).decode()}"
+
+
+def image_content(image_bytes, detail="high", **kwargs):
+    """Chat message part for an uploaded image, ready for the vision call."""
+    prepared = prepare_image(image_bytes, detail=detail, **kwargs)
+    return {"type": "image_url", "image_url": {"url": to_data_url(prepared), "detail": detail}}
+
+
+# ===== 📊 Benchmark: python vision_input.py photo.jpg [more.png ...] =====
+def benchmark(paths, detail="high", fmt=DEFAULT_FORMAT):
+    total_before = total_after = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            raw = f.read()
+        original = Image.open(BytesIO(raw))
+        before_tokens = image_tokens(*original.size, detail="high")
+        prepared = prepare_image(raw, detail=detail, fmt=fmt)
+        before = len(base64.b64encode(raw))
+        after = len(base64.b64encode(prepared.data))
+        total_before += before
+        total_after += after
+        print(
+            f"{path}: {original.size[0]}x{original.size[1]} -> {prepared.width}x{prepared.height} {prepared.mime} | "
+            f"payload {before / 1024:.0f} KB -> {after / 1024:.0f} KB ({100 - 100 * after / before:.0f}% saved) | "
+            f"image tokens {before_tokens} -> {prepared.tokens}"
+        )
+    if total_before:
+        print(f"total payload {total_before / 1024:.0f} KB -> {total_after / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    detail = "high"
+    if args and args[0] in ("--low", "--high"):
+        detail = args.pop(0)[2:]
+    if not args:
+        sys.exit("usage: python vision_input.py [--low|--high] IMAGE [IMAGE ...]")
+    benchmark(args, detail=detail)